@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+ローカルのopenBDスタブを相手に取得処理とフィード生成を計測するベンチマーク
+
+openbd_stub.pyのサーバーを別プロセスで起動し、一時ディレクトリ上で
+fetch_shinsho.main()（全件スキャンと差分更新）と generate_rss.generate_feed() を実行して、
+スループット・レイテンシ・メモリを計測する。計測の前に、新書判定の高速パスが従来の判定と
+同じ結果になることをサンプル（verify_classifier.py）で確かめ、異なれば失敗として終了する。is_shinsho・extract_book_info・
+create_description などのマイクロベンチマークも行い、結果は実行ごとに
+data/benchmark_results.jsonl に追記して前回の結果と比較する。
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+import book_record
+import data_paths
+import feed_archive
+import feed_groups
+import fetch_shinsho
+import generate_rss
+import openbd_stub
+import run_metrics
+import search_index
+import verify_classifier
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+BENCHMARK_RESULTS_FILE = os.path.join(DATA_DIR, "benchmark_results.jsonl")
+STUB_STARTUP_TIMEOUT = 120  # スタブのカタログ生成と起動を待つ秒数
+MICRO_SAMPLE_SIZE = 1000  # マイクロベンチマークに使う書籍数
+DEFAULT_REPEAT = 5  # マイクロベンチマークの繰り返し回数（最良値を採用）
+MEMORY_SAMPLE_SIZE = 20000  # レコードのメモリ使用量の計測に使うレコード数
+LATENCY_STAGES = ("http_request", "fetch_batch", "process_batch")  # 結果に残すレイテンシ
+COMPARED_METRICS = (  # 前回との比較に表示する指標（小さいほど良いものは False）
+    ("full_scan.isbns_per_second", True),
+    ("full_scan.elapsed_seconds", False),
+    ("full_scan.peak_memory_mb", False),
+    ("diff.elapsed_seconds", False),
+    ("feed.elapsed_seconds", False),
+    ("micro.is_shinsho_ns", False),
+    ("micro.extract_book_info_ns", False),
+    ("micro.create_description_ns", False),
+    ("micro.iter_candidate_books_ms", False),
+    ("memory.compact_bytes_per_record", False),
+)
+
+
+def start_stub(args: argparse.Namespace):
+    """
+    openBDスタブを別プロセスで起動し、(ベースURL, ISBN数, プロセス) を返す
+    """
+    context = multiprocessing.get_context("spawn")
+    ready_queue = context.Queue()
+    process = context.Process(
+        target=openbd_stub.serve_in_process,
+        args=(args.size, args.fixture, args.shinsho_ratio, args.latency, args.error_rate, ready_queue),
+        daemon=True
+    )
+    process.start()
+    base_url, catalogue_size = ready_queue.get(timeout=STUB_STARTUP_TIMEOUT)
+    return base_url, catalogue_size, process
+
+
+def use_sandbox(directory: str, base_url: str) -> str:
+    """
+    APIの接続先をスタブに、フィードの保存先を一時ディレクトリに切り替え、
+    取得処理に --data-dir で渡すデータの保存先を返す
+    """
+    data_dir = os.path.join(directory, "data")
+    docs_dir = os.path.join(directory, "docs")
+    fetch_shinsho.API_BASE_URL = base_url
+    generate_rss.DATA_DIR = data_dir
+    generate_rss.DOCS_DIR = docs_dir
+    generate_rss.NEW_RECORDS_FILE = data_paths.resolve(fetch_shinsho.NEW_RECORDS_FILE, data_dir)
+    generate_rss.FEED_HISTORY_FILE = os.path.join(data_dir, os.path.basename(generate_rss.FEED_HISTORY_FILE))
+    generate_rss.FEED_FILE = os.path.join(docs_dir, os.path.basename(generate_rss.FEED_FILE))
+    generate_rss.FEED_STATE_FILE = os.path.join(data_dir, os.path.basename(generate_rss.FEED_STATE_FILE))
+    feed_archive.DATA_DIR = data_dir
+    feed_archive.ARCHIVE_DIR = os.path.join(docs_dir, os.path.basename(feed_archive.ARCHIVE_DIR))
+    feed_archive.ARCHIVE_STATE_FILE = os.path.join(data_dir, os.path.basename(feed_archive.ARCHIVE_STATE_FILE))
+    feed_groups.DATA_DIR = data_dir
+    feed_groups.GROUP_HISTORY_FILE = os.path.join(data_dir, os.path.basename(feed_groups.GROUP_HISTORY_FILE))
+    feed_groups.FEEDS_DIR = os.path.join(docs_dir, os.path.basename(feed_groups.FEEDS_DIR))
+    feed_groups.FEED_INDEX_FILE = os.path.join(feed_groups.FEEDS_DIR, os.path.basename(feed_groups.FEED_INDEX_FILE))
+    feed_groups.FEED_OPML_FILE = os.path.join(feed_groups.FEEDS_DIR, os.path.basename(feed_groups.FEED_OPML_FILE))
+    search_index.DATA_DIR = data_dir
+    search_index.SEARCH_DIR = os.path.join(docs_dir, os.path.basename(search_index.SEARCH_DIR))
+    search_index.SEARCH_STATE_FILE = os.path.join(data_dir, os.path.basename(search_index.SEARCH_STATE_FILE))
+    return data_dir
+
+
+def quiet(verbose: bool):
+    """
+    verboseでなければ計測対象の標準出力を捨てる
+    """
+    return redirect_stdout(sys.stdout if verbose else io.StringIO())
+
+
+def run_fetch(options: List[str], data_dir: str, verbose: bool) -> Dict:
+    """
+    fetch_shinsho.main() を実行し、実行レポートから主要な指標を取り出す
+    """
+    saved_argv = sys.argv
+    sys.argv = ["fetch_shinsho.py", "--data-dir", data_dir] + options
+    try:
+        with quiet(verbose):
+            fetch_shinsho.main()
+    finally:
+        sys.argv = saved_argv
+
+    with open(data_paths.resolve(run_metrics.RUN_REPORT_FILE, data_dir), "r", encoding="utf-8") as f:
+        report = json.load(f)
+    summary = {
+        "elapsed_seconds": report["elapsed_seconds"],
+        "peak_memory_mb": report["peak_memory_mb"],
+        "isbns_per_second": report["throughput"]["isbns_per_second"],
+        "records_per_second": report["throughput"]["records_per_second"],
+        "bytes_per_second": report["throughput"]["bytes_per_second"],
+        "isbns_processed": report["result"]["processed_isbns"],
+        "new_records": report["result"]["new_records"],
+        "errors": report["result"]["errors"]
+    }
+    for name in LATENCY_STAGES:
+        stage = report["stages"].get(name)
+        if stage:
+            summary[f"{name}_p50_ms"] = stage["p50_ms"]
+            summary[f"{name}_p90_ms"] = stage["p90_ms"]
+            summary[f"{name}_p99_ms"] = stage["p99_ms"]
+    return summary
+
+
+def run_feed(verbose: bool) -> Dict:
+    """
+    generate_rss.generate_feed() の所要時間を計測
+    """
+    start = time.perf_counter()
+    with quiet(verbose):
+        generate_rss.generate_feed()
+    return {"elapsed_seconds": round(time.perf_counter() - start, 3)}
+
+
+def best_time(func: Callable, items: Iterable, repeat: int) -> float:
+    """
+    itemsの各要素にfuncを適用する処理をrepeat回計測し、1要素あたりの最短秒数を返す
+    """
+    items = list(items)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / max(1, len(items))
+
+
+def micro_benchmarks(repeat: int) -> Dict:
+    """
+    判定・抽出・説明文生成・デコードのマイクロベンチマーク
+    """
+    catalogue = openbd_stub.synthetic_catalogue(MICRO_SAMPLE_SIZE, shinsho_ratio=0.5)
+    raw = b"[" + b",".join(catalogue.values()) + b"]"
+    books = [json.loads(body) for body in catalogue.values()]
+    records = [fetch_shinsho.extract_book_info(book) for book in books]
+
+    return {
+        "is_shinsho_ns": round(best_time(fetch_shinsho.is_shinsho, books, repeat) * 1e9, 1),
+        "extract_book_info_ns": round(best_time(fetch_shinsho.extract_book_info, books, repeat) * 1e9, 1),
+        "create_description_ns": round(best_time(generate_rss.create_description, records, repeat) * 1e9, 1),
+        # 1000件分のレスポンス本文1つあたりのミリ秒
+        "iter_books_ms": round(best_time(lambda body: list(fetch_shinsho.iter_books(body)), [raw], repeat) * 1e3, 3),
+        "iter_candidate_books_ms": round(
+            best_time(lambda body: list(fetch_shinsho.iter_candidate_books(body)), [raw], repeat) * 1e3, 3)
+    }
+
+
+def traced_bytes(build: Callable[[], object]) -> int:
+    """
+    build()が返すオブジェクトを保持した状態で増えたメモリ量（バイト）を返す
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def record_memory() -> Dict:
+    """
+    保存済みレコードを辞書のまま読み込んだ場合とBookRecordに変換した場合のメモリ使用量を比較
+    """
+    catalogue = openbd_stub.synthetic_catalogue(MEMORY_SAMPLE_SIZE, shinsho_ratio=1.0)
+    lines = [json.dumps(book_record.to_plain(fetch_shinsho.extract_book_info(json.loads(body))), ensure_ascii=False)
+             for body in catalogue.values()]
+    dict_bytes = traced_bytes(lambda: [json.loads(line) for line in lines])
+    compact_bytes = traced_bytes(lambda: [book_record.compact_record(json.loads(line)) for line in lines])
+    return {
+        "records": len(lines),
+        "dict_bytes_per_record": round(dict_bytes / len(lines), 1),
+        "compact_bytes_per_record": round(compact_bytes / len(lines), 1),
+        "saving_percent": round((1 - compact_bytes / dict_bytes) * 100, 1)
+    }
+
+
+def git_revision() -> Optional[str]:
+    """
+    計測したコードのコミットを返す（gitが使えなければNone）
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results() -> List[Dict]:
+    """
+    保存済みのベンチマーク結果を読み込む
+    """
+    if not os.path.exists(BENCHMARK_RESULTS_FILE):
+        return []
+    with open(BENCHMARK_RESULTS_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_result(result: Dict):
+    """
+    ベンチマーク結果を1行追記
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(BENCHMARK_RESULTS_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def metric_value(result: Dict, path: str) -> Optional[float]:
+    """
+    "full_scan.elapsed_seconds" のようなパスで結果の値を取り出す
+    """
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def print_comparison(previous: Dict, current: Dict):
+    """
+    同じ条件で計測した前回の結果との差を表示
+    """
+    print(f"\n前回の結果との比較 ({previous['timestamp']}, {previous.get('revision') or '不明'}):")
+    for path, higher_is_better in COMPARED_METRICS:
+        before, after = metric_value(previous, path), metric_value(current, path)
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        improved = change > 0 if higher_is_better else change < 0
+        print(f"- {path}: {before} → {after} ({change:+.1f}%{'' if abs(change) < 1 else ' 改善' if improved else ' 悪化'})")
+
+
+def print_result(result: Dict):
+    """
+    計測結果を表示
+    """
+    for section in ("full_scan", "diff", "feed", "micro", "memory"):
+        if section not in result:
+            continue
+        print(f"\n[{section}]")
+        for key, value in result[section].items():
+            print(f"- {key}: {value}")
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = argparse.ArgumentParser(description='ローカルのopenBDスタブを使ったベンチマーク')
+    parser.add_argument('--size', type=int, default=openbd_stub.DEFAULT_SIZE, help='合成するカタログのISBN数')
+    parser.add_argument('--shinsho-ratio', type=float, default=openbd_stub.DEFAULT_SHINSHO_RATIO, help='合成データのうち新書の割合')
+    parser.add_argument('--fixture', default=None, help='合成データの代わりに使う記録済みのレスポンス')
+    parser.add_argument('--latency', type=float, default=0.0, help='/get の応答を遅らせる秒数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='/get が503を返す確率')
+    parser.add_argument('--workers', type=int, default=4, help='fetch_shinsho.py の --workers')
+    parser.add_argument('--parse-workers', type=int, default=0, help='fetch_shinsho.py の --parse-workers')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='マイクロベンチマークの繰り返し回数')
+    parser.add_argument('--classifier-sample', default=verify_classifier.SAMPLE_FILE, help='新書判定の検証に使うサンプル')
+    parser.add_argument('--skip-verify', action='store_true', help='新書判定の検証を省略する')
+    parser.add_argument('--skip-e2e', action='store_true', help='取得処理とフィード生成の計測を省略する')
+    parser.add_argument('--skip-micro', action='store_true', help='マイクロベンチマークを省略する')
+    parser.add_argument('--label', default=None, help='結果に付けるラベル')
+    parser.add_argument('--no-save', action='store_true', help='結果を保存しない')
+    parser.add_argument('--verbose', action='store_true', help='計測対象の出力を表示する')
+    args = parser.parse_args()
+
+    params = {
+        "size": args.size, "shinsho_ratio": args.shinsho_ratio, "fixture": args.fixture,
+        "latency": args.latency, "error_rate": args.error_rate,
+        "workers": args.workers, "parse_workers": args.parse_workers
+    }
+    result = {
+        "timestamp": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params
+    }
+
+    if not args.skip_verify:
+        # 判定結果が変わっている場合は、速度を比べる意味がないため計測せずに終了する
+        print("新書判定の高速パスを検証中...")
+        if not verify_classifier.verify_sample(verify_classifier.load_sample(args.classifier_sample)):
+            sys.exit(1)
+
+    if not args.skip_e2e:
+        print("openBDスタブを起動しています...")
+        base_url, catalogue_size, process = start_stub(args)
+        print(f"起動しました: {base_url} (ISBN数: {catalogue_size})")
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                data_dir = use_sandbox(directory, base_url)
+                options = ["--rate-limit", "0", "--workers", str(args.workers),
+                           "--parse-workers", str(args.parse_workers)]
+                print("全件スキャンを計測中...")
+                result["full_scan"] = run_fetch(options, data_dir, args.verbose)
+                # 全件スキャンで見つかった新書からフィードを生成する
+                print("フィード生成を計測中...")
+                result["feed"] = run_feed(args.verbose)
+                print("差分更新を計測中...")
+                result["diff"] = run_fetch(options, data_dir, args.verbose)
+        finally:
+            process.terminate()
+
+    if not args.skip_micro:
+        print("マイクロベンチマークを計測中...")
+        result["micro"] = micro_benchmarks(args.repeat)
+        print("レコードのメモリ使用量を計測中...")
+        result["memory"] = record_memory()
+
+    print_result(result)
+    previous = [entry for entry in load_results() if entry.get("params") == params]
+    if previous:
+        print_comparison(previous[-1], result)
+    if not args.no_save:
+        save_result(result)
+        print(f"\n結果を保存しました: {BENCHMARK_RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+新書レコードのメモリ効率のよい表現を提供するモジュール
+
+レコードは __slots__ を持つクラスで保持し、出版社・レーベル・出版日・役割コード・
+著者名のように多くのレコードで繰り返される文字列はインターンして共有する。
+辞書と同じ get / [] / items で参照でき、to_dict で現在のJSONスキーマの辞書に
+キーの順序も含めて元どおりに戻せる。スキーマと異なる形の辞書は変換せずにそのまま扱う。
+"""
+import sys
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+# 定数
+RECORD_FIELDS = ("isbn", "title", "subtitle", "collection", "authors",
+                 "imprint", "publisher", "publishing_date", "fetched_at")
+AUTHOR_FIELDS = ("name", "role", "bio")
+INTERNED_FIELDS = ("collection", "imprint", "publisher", "publishing_date")  # 多くのレコードで繰り返される値
+
+
+def intern(value):
+    """
+    文字列ならインターンして同じ値のオブジェクトを共有する
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Author:
+    """
+    著者情報（name, role, bio）
+    """
+    __slots__ = AUTHOR_FIELDS
+
+    def __init__(self, name, role, bio):
+        self.name = intern(name)
+        self.role = intern(role)
+        self.bio = bio
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in AUTHOR_FIELDS else default
+
+    def __getitem__(self, key: str):
+        if key not in AUTHOR_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "role": self.role, "bio": self.bio}
+
+
+class BookRecord:
+    """
+    新書レコード（フィールドは extract_book_info の出力と同じ）
+    """
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, isbn, title, subtitle, collection, authors: Iterable[Author],
+                 imprint, publisher, publishing_date, fetched_at):
+        self.isbn = isbn
+        self.title = title
+        self.subtitle = subtitle
+        self.collection = intern(collection)
+        self.authors: Tuple[Author, ...] = tuple(authors)
+        self.imprint = intern(imprint)
+        self.publisher = intern(publisher)
+        self.publishing_date = intern(publishing_date)
+        self.fetched_at = fetched_at
+
+    def get(self, key: str, default=None):
+        if key not in RECORD_FIELDS:
+            return default
+        if key == "authors":
+            return [author.to_dict() for author in self.authors]
+        return getattr(self, key)
+
+    def __getitem__(self, key: str):
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __setitem__(self, key: str, value):
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        if key == "authors":
+            value = tuple(Author(**author) for author in value)
+        elif key in INTERNED_FIELDS:
+            value = intern(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in RECORD_FIELDS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(RECORD_FIELDS)
+
+    def keys(self) -> Tuple[str, ...]:
+        return RECORD_FIELDS
+
+    def items(self) -> List[Tuple[str, object]]:
+        return list(self.to_dict().items())
+
+    def to_dict(self) -> Dict:
+        return {
+            "isbn": self.isbn,
+            "title": self.title,
+            "subtitle": self.subtitle,
+            "collection": self.collection,
+            "authors": [author.to_dict() for author in self.authors],
+            "imprint": self.imprint,
+            "publisher": self.publisher,
+            "publishing_date": self.publishing_date,
+            "fetched_at": self.fetched_at
+        }
+
+
+Record = Union[BookRecord, Dict]
+
+
+def compact_record(data: Dict) -> Record:
+    """
+    JSONから読み込んだ辞書をBookRecordに変換する
+    キーの構成や順序が現在のスキーマと異なる場合は、元に戻せるよう辞書のまま返す
+    """
+    if isinstance(data, BookRecord):
+        return data
+    if tuple(data) != RECORD_FIELDS or not isinstance(data["authors"], list):
+        return data
+    authors = data["authors"]
+    if any(not isinstance(author, dict) or tuple(author) != AUTHOR_FIELDS for author in authors):
+        return data
+    return BookRecord(
+        data["isbn"], data["title"], data["subtitle"], data["collection"],
+        (Author(author["name"], author["role"], author["bio"]) for author in authors),
+        data["imprint"], data["publisher"], data["publishing_date"], data["fetched_at"]
+    )
+
+
+def to_plain(record: Record) -> Dict:
+    """
+    JSONに保存できる辞書に戻す
+    """
+    return record.to_dict() if isinstance(record, BookRecord) else record
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+データファイルの保存先を解決するモジュール
+
+各モジュールは data/ 内の既定のパスを定数として持ち、読み書きする関数は
+保存先のディレクトリ（data_dir）を引数で受け取る。data_dirを省略した場合は既定のパスを使い、
+指定した場合は同じ名前のファイルをそのディレクトリ内に置く（シャードやベンチマークの出力先）。
+"""
+import os
+from typing import Optional
+
+
+def resolve(default_path: str, data_dir: Optional[str] = None) -> str:
+    """
+    data_dirを指定した場合はその中の、省略した場合は既定のデータファイルのパスを返す
+    """
+    if data_dir is None:
+        return default_path
+    return os.path.join(data_dir, os.path.basename(default_path))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+RFC 5005（Feed Paging and Archiving）形式のアーカイブフィードを管理するモジュール
+
+全体のフィード（docs/index.xml）には新しいエントリーだけを載せ、あふれた古いエントリーは
+ARCHIVE_PAGE_SIZE件ずつ docs/archive/<番号>.xml に書き出す。アーカイブページは一度書いたら
+変更しない（番号は古いものほど小さい）。各ページは prev-archive で一つ前のページを、
+current で最新のフィードを指すため、リーダーは最新のフィードからさかのぼって取りこぼしを補える。
+"""
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from feedgen.ext.base import BaseEntryExtension, BaseExtension
+
+import book_record
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs")
+ARCHIVE_DIR = os.path.join(DOCS_DIR, "archive")
+ARCHIVE_STATE_FILE = os.path.join(DATA_DIR, "feed_archive.json")
+ARCHIVE_PAGE_SIZE = 50  # アーカイブページ1件あたりのエントリー数
+ATOM_NS = "http://www.w3.org/2005/Atom"
+FEED_HISTORY_NS = "http://purl.org/syndication/history/1.0"
+
+
+class FeedHistoryExtension(BaseExtension):
+    """
+    RSSのチャンネルにRFC 5005のリンク（prev-archive / current）とfh:archive要素を追加する
+    feedgenの拡張
+    """
+
+    def __init__(self):
+        self.links: List[Tuple[str, str]] = []
+        self.archive = False
+
+    def extend_ns(self) -> Dict[str, str]:
+        return {"fh": FEED_HISTORY_NS}
+
+    def extend_rss(self, feed):
+        channel = feed[0]
+        for rel, href in self.links:
+            channel.append(channel.makeelement(f"{{{ATOM_NS}}}link", {"href": href, "rel": rel}))
+        if self.archive:
+            channel.append(channel.makeelement(f"{{{FEED_HISTORY_NS}}}archive", {}))
+        return feed
+
+
+def register(fg, links: List[Tuple[str, str]], archive: bool):
+    """
+    フィードジェネレーターにページングのリンクとアーカイブ指定を設定する
+    """
+    fg.register_extension("feed_history", FeedHistoryExtension, BaseEntryExtension, atom=False)
+    fg.feed_history.links = links
+    fg.feed_history.archive = archive
+
+
+def archive_path(page: int) -> str:
+    """
+    アーカイブページの保存先を返す
+    """
+    return os.path.join(ARCHIVE_DIR, f"{page}.xml")
+
+
+def archive_url(site_url: str, page: int) -> str:
+    """
+    アーカイブページのURLを返す
+    """
+    return f"{site_url}/archive/{page}.xml"
+
+
+def load_archive_state() -> Dict:
+    """
+    アーカイブページ数とアーカイブ済みのISBNを読み込む
+    """
+    if os.path.exists(ARCHIVE_STATE_FILE):
+        with open(ARCHIVE_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"pages": 0, "isbns": []}
+
+
+def save_archive_state(state: Dict):
+    """
+    アーカイブページ数とアーカイブ済みのISBNを保存
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(ARCHIVE_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def split_archive_pages(entries: List[book_record.Record], head_size: int,
+                        page_size: int = ARCHIVE_PAGE_SIZE) -> Tuple[List[book_record.Record], List[List[book_record.Record]]]:
+    """
+    新しい順に並んだエントリーを、最新のフィードに残す分とアーカイブするページ（古い順）に分ける
+    最新のフィードには常にhead_size件以上、head_size + page_size件未満が残る
+    """
+    pages = []
+    while len(entries) >= head_size + page_size:
+        # 末尾（最も古い側）から切り出すため、ページは古い順に並ぶ
+        pages.append(entries[-page_size:])
+        entries = entries[:-page_size]
+    return entries, pages
+
+
+def page_links(site_url: str, feed_url: str, page: Optional[int], pages: int) -> List[Tuple[str, str]]:
+    """
+    最新のフィード（pageがNone）またはアーカイブページに付けるリンクを返す
+    アーカイブページは変更しないため、後から作られるページへのnext-archiveは付けない
+    """
+    if page is None:
+        return [("prev-archive", archive_url(site_url, pages))] if pages else []
+    links = [("current", feed_url)]
+    if page > 1:
+        links.append(("prev-archive", archive_url(site_url, page - 1)))
+    return links
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+シリーズ（レーベル）別・出版社別のフィードの履歴と一覧を管理するモジュール
+
+各フィードの履歴は data/feed_groups.json にまとめて保存し、新規・削除・更新された
+レコードを1回走査するだけで各フィードの履歴を更新する。内容が変わったフィードだけを
+書き直せるよう、更新で変化したフィードの集合を返す。
+フィードの一覧は docs/feeds/index.json（ページ用）と docs/feeds/index.opml（RSSリーダー用）に出力する。
+"""
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, List, Set, Tuple
+
+import book_record
+import feed_order
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs")
+GROUP_HISTORY_FILE = os.path.join(DATA_DIR, "feed_groups.json")
+FEEDS_DIR = os.path.join(DOCS_DIR, "feeds")
+FEED_INDEX_FILE = os.path.join(FEEDS_DIR, "index.json")
+FEED_OPML_FILE = os.path.join(FEEDS_DIR, "index.opml")
+GROUP_FIELDS = {
+    "collection": ("collection",),  # シリーズ（レーベル）
+    "publisher": ("imprint", "publisher")  # 出版社（発行元がなければ発売元）
+}
+GROUP_LABELS = {"collection": "シリーズ", "publisher": "出版社"}
+SLUG_LENGTH = 12  # フィードのファイル名に使うハッシュの桁数
+
+GroupKey = Tuple[str, str]  # (種類, 名前)
+GroupHistory = Dict[str, Dict[str, List[book_record.Record]]]
+
+
+def group_name(book: book_record.Record, kind: str) -> str:
+    """
+    レコードが属するグループ名を返す（該当する値がなければ空文字列）
+    """
+    for field in GROUP_FIELDS[kind]:
+        value = book.get(field) or ""
+        if value:
+            return value
+    return ""
+
+
+def group_keys(book: book_record.Record) -> List[GroupKey]:
+    """
+    レコードが属するすべてのグループを返す
+    """
+    return [(kind, name) for kind in GROUP_FIELDS for name in (group_name(book, kind),) if name]
+
+
+def feed_slug(kind: str, name: str) -> str:
+    """
+    グループのフィードのファイル名（拡張子なし）を返す
+    名前には記号や空白が含まれるため、名前のハッシュから決める
+    """
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:SLUG_LENGTH]
+    return f"{kind}-{digest}"
+
+
+def feed_path(kind: str, name: str) -> str:
+    """
+    グループのフィードの保存先を返す
+    """
+    return os.path.join(FEEDS_DIR, f"{feed_slug(kind, name)}.xml")
+
+
+def feed_url(site_url: str, kind: str, name: str) -> str:
+    """
+    グループのフィードのURLを返す
+    """
+    return f"{site_url}/feeds/{feed_slug(kind, name)}.xml"
+
+
+def feed_title(kind: str, name: str) -> str:
+    """
+    グループのフィードのタイトルを返す
+    """
+    return f"{name}の新刊 - 新書新刊情報"
+
+
+def feed_subtitle(kind: str, name: str) -> str:
+    """
+    グループのフィードの説明を返す
+    """
+    return f"openBD APIから取得した{GROUP_LABELS[kind]}「{name}」の新書の新刊情報を配信します"
+
+
+def load_group_history() -> GroupHistory:
+    """
+    グループごとのフィード履歴を読み込む
+    """
+    histories: GroupHistory = {kind: {} for kind in GROUP_FIELDS}
+    if os.path.exists(GROUP_HISTORY_FILE):
+        with open(GROUP_HISTORY_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for kind, groups in data.items():
+            histories.setdefault(kind, {})
+            for name, entries in groups.items():
+                histories[kind][name] = [book_record.compact_record(entry) for entry in entries]
+    return histories
+
+
+def save_group_history(histories: GroupHistory):
+    """
+    グループごとのフィード履歴を保存
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    data = {
+        kind: {name: [book_record.to_plain(entry) for entry in entries] for name, entries in sorted(groups.items())}
+        for kind, groups in histories.items()
+    }
+    tmp_path = f"{GROUP_HISTORY_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, GROUP_HISTORY_FILE)
+
+
+def update_group_history(histories: GroupHistory, new_records: Iterable[book_record.Record],
+                         removed_isbns: Set[str], updated_records: Dict[str, book_record.Record],
+                         max_entries: int, order: str = feed_order.DEFAULT_ORDER_POLICY) -> Set[GroupKey]:
+    """
+    削除・更新・新規のレコードをグループごとの履歴に反映し、内容が変わったグループを返す
+    並び順は全体のフィードと同じくorderに従う
+    """
+    changed: Set[GroupKey] = set()
+
+    # 削除された書籍の取り下げと、再取得で更新された書籍の差し替え
+    if removed_isbns or updated_records:
+        for kind, groups in histories.items():
+            for name, entries in list(groups.items()):
+                kept, modified = feed_order.apply_changes(entries, removed_isbns, updated_records, order)
+                if modified:
+                    changed.add((kind, name))
+                    if kept:
+                        groups[name] = kept
+                    else:
+                        del groups[name]
+
+    # 新規レコードを1回の走査でグループごとに振り分ける
+    additions: Dict[GroupKey, List[book_record.Record]] = {}
+    for book in new_records:
+        for key in group_keys(book):
+            additions.setdefault(key, []).append(book)
+
+    for (kind, name), books in additions.items():
+        entries = histories.setdefault(kind, {}).get(name, [])
+        merged, added_count = feed_order.merge_new_records(entries, books, order, max_entries=max_entries)
+        # 履歴全体を比較せず追加件数で判定する（切り詰めで押し出された場合も書き出し時に内容で比較される）
+        if added_count:
+            histories[kind][name] = merged
+            changed.add((kind, name))
+    return changed
+
+
+def build_index(histories: GroupHistory, site_url: str) -> List[Dict]:
+    """
+    フィードの一覧（種類・名前の順）を作成
+    """
+    index = []
+    for kind in GROUP_FIELDS:
+        for name, entries in sorted(histories.get(kind, {}).items()):
+            index.append({
+                "kind": kind,
+                "name": name,
+                "title": feed_title(kind, name),
+                "url": feed_url(site_url, kind, name),
+                "entries": len(entries),
+                "latest_isbn": entries[0].get("isbn") if entries else None
+            })
+    return index
+
+
+def render_opml(index: List[Dict]) -> bytes:
+    """
+    フィードの一覧をOPMLに変換
+    """
+    opml = ET.Element("opml", version="2.0")
+    head = ET.SubElement(opml, "head")
+    ET.SubElement(head, "title").text = "新書新刊情報 - シリーズ別・出版社別フィード"
+    body = ET.SubElement(opml, "body")
+    for kind in GROUP_FIELDS:
+        outline = ET.SubElement(body, "outline", text=GROUP_LABELS[kind])
+        for feed in index:
+            if feed["kind"] == kind:
+                ET.SubElement(outline, "outline", type="rss", text=feed["name"],
+                              title=feed["title"], xmlUrl=feed["url"])
+    ET.indent(opml)
+    return ET.tostring(opml, encoding="utf-8", xml_declaration=True) + b"\n"
+
+
+def write_if_changed(path: str, content: bytes) -> bool:
+    """
+    内容が変わった場合のみファイルを書き換え、書き換えたかを返す
+    """
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def write_index(histories: GroupHistory, site_url: str) -> bool:
+    """
+    フィードの一覧をJSONとOPMLで保存し、いずれかを書き換えたかを返す
+    """
+    index = build_index(histories, site_url)
+    content = json.dumps(index, ensure_ascii=False, indent=2).encode("utf-8") + b"\n"
+    json_written = write_if_changed(FEED_INDEX_FILE, content)
+    opml_written = write_if_changed(FEED_OPML_FILE, render_opml(index))
+    return json_written or opml_written
+
+
+def remove_feed(kind: str, name: str) -> str:
+    """
+    エントリーがなくなったグループのフィードとそのgzip圧縮版を削除し、フィードのパスを返す
+    """
+    path = feed_path(kind, name)
+    for target in (path, f"{path}.gz"):
+        if os.path.exists(target):
+            os.remove(target)
+    return path
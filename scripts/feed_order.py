@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+フィード履歴の並び順を管理するモジュール
+
+フィード履歴は新しいものが先頭のリストで保持し、ISBNの集合（辞書）で重複を判定する。
+新規レコードの追加・重複の除去・切り詰めはいずれも履歴と新規レコードの件数に比例する時間で行う。
+並び順は次のいずれか：
+- fetched: 取得した順（後から取得したものほど先頭。従来どおり）
+- published: 出版日の新しい順（同じ出版日なら取得日時の新しい順）
+"""
+import heapq
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import book_record
+
+# 定数
+ORDER_POLICIES = ("fetched", "published")
+DEFAULT_ORDER_POLICY = "fetched"
+DATE_DIGITS = 8  # 出版日を比較するときの桁数（YYYYMMDD）
+
+Record = book_record.Record
+
+
+def publication_key(book: Record) -> Tuple[str, str]:
+    """
+    出版日順の並べ替えキー（出版日の数字をYYYYMMDDにそろえたもの、取得日時）
+    出版日が年月までしかない場合は日を0とみなす
+    """
+    digits = "".join(ch for ch in (book.get("publishing_date") or "") if ch.isdigit())
+    return digits[:DATE_DIGITS].ljust(DATE_DIGITS, "0"), book.get("fetched_at") or ""
+
+
+def is_sorted_desc(entries: List[Record], key: Callable[[Record], Tuple]) -> bool:
+    """
+    エントリーがキーの降順に並んでいるかを判定
+    """
+    keys = [key(entry) for entry in entries]
+    return all(a >= b for a, b in zip(keys, keys[1:]))
+
+
+def merge_new_records(history: List[Record], new_records: Iterable[Record], policy: str = DEFAULT_ORDER_POLICY,
+                      exclude: Iterable[str] = (), max_entries: Optional[int] = None) -> Tuple[List[Record], int]:
+    """
+    新しいものが先頭の履歴に新規レコードを追加し、(新しい履歴, 追加した件数) を返す
+    履歴とexcludeに含まれるISBN、新規レコード内で重複するISBNは追加しない
+    max_entriesを指定すると先頭からその件数に切り詰める
+    """
+    known: Set[str] = {entry.get("isbn") for entry in history}
+    known.update(exclude)
+
+    if policy == "fetched" and max_entries is not None:
+        # 取得順では後ろのmax_entries件より前の新規レコードは先頭に並ばないため、候補から外す
+        # （同じ新規レコードで再実行しても、切り詰め済みのレコードが再び先頭に戻らない）
+        new_records = list(new_records)[-max_entries:]
+
+    added = []
+    for book in new_records:
+        isbn = book.get("isbn")
+        if isbn not in known:
+            known.add(isbn)
+            added.append(book)
+
+    if policy == "published":
+        # 新規分だけを並べ替え、並べ替え済みの履歴と線形時間でマージする
+        if not is_sorted_desc(history, publication_key):
+            history = sorted(history, key=publication_key, reverse=True)
+        added.sort(key=publication_key, reverse=True)
+        merged = list(heapq.merge(added, history, key=publication_key, reverse=True))
+    elif policy == "fetched":
+        added.reverse()
+        merged = added + history
+    else:
+        raise ValueError(f"不明な並び順です: {policy}")
+
+    if max_entries is not None:
+        merged = merged[:max_entries]
+    return merged, len(added)
+
+
+def apply_changes(history: List[Record], removed_isbns: Set[str],
+                  updated_records: Dict[str, Record], policy: str = DEFAULT_ORDER_POLICY) -> Tuple[List[Record], bool]:
+    """
+    削除された書籍を取り除き、再取得で内容が変わった書籍を同じ位置で差し替える
+    (新しい履歴, 変更があったか) を返す。出版日順では出版日の変更に合わせて並べ直す
+    """
+    if not removed_isbns and not updated_records:
+        return history, False
+    kept = []
+    modified = False
+    for entry in history:
+        isbn = entry.get("isbn")
+        if isbn in removed_isbns:
+            modified = True
+            continue
+        updated = updated_records.get(isbn)
+        if updated is not None and book_record.to_plain(updated) != book_record.to_plain(entry):
+            entry = updated
+            modified = True
+        kept.append(entry)
+    if modified and policy == "published" and not is_sorted_desc(kept, publication_key):
+        kept.sort(key=publication_key, reverse=True)
+    return kept, modified
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+生成したフィード（docs/）をローカルで配信する簡易HTTPサーバー
+
+ETag / Last-Modified を付けて応答し、If-None-Match / If-Modified-Since による
+条件付きリクエストには変更がなければ304で応答する。フィードは内容が変わったときだけ
+書き換えられるため、ファイルの更新時刻とサイズから作るETagも内容が同じ間は変わらない。
+gzipを受け付けるクライアントには、隣にある圧縮済みの .gz ファイルをそのまま返す。
+"""
+import argparse
+import functools
+import os
+import threading
+from email.utils import parsedate_to_datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+# 定数
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+
+class FeedRequestHandler(SimpleHTTPRequestHandler):
+    """
+    静的ファイルにETag / Last-Modifiedを付け、条件付きリクエストに304で応答するハンドラー
+    """
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.endswith("/"):
+            path = os.path.join(path, "index.html")
+        if not os.path.isfile(path):
+            # ディレクトリのリダイレクトや404は標準の処理に任せる
+            return super().send_head()
+
+        compressed = f"{path}.gz"
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "") and os.path.isfile(compressed)
+        target = compressed if use_gzip else path
+        stat = os.stat(target)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-gz" if use_gzip else ""}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": self.date_time_string(int(stat.st_mtime)),
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding"
+        }
+
+        if self.is_not_modified(etag, int(stat.st_mtime)):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return None
+
+        f = open(target, "rb")
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(stat.st_size))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        return f
+
+    def is_not_modified(self, etag: str, mtime: int) -> bool:
+        """
+        条件付きリクエストのヘッダーから、クライアントの持つ内容が最新かを判定
+        If-None-Matchがあればそれを優先し、If-Modified-Sinceは無視する
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+def create_server(directory: str = DOCS_DIR, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    指定したディレクトリを配信するサーバーを作成（port=0で空いているポートを使う）
+    """
+    handler = functools.partial(FeedRequestHandler, directory=directory)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(server: ThreadingHTTPServer) -> Tuple[str, threading.Thread]:
+    """
+    サーバーをバックグラウンドスレッドで起動し、配信先のURLを返す
+    """
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/", thread
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = argparse.ArgumentParser(description='生成したフィードをローカルで配信する簡易HTTPサーバー')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='待ち受けるアドレス')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='待ち受けるポート番号')
+    parser.add_argument('--directory', default=DOCS_DIR, help='配信するディレクトリ')
+    args = parser.parse_args()
+
+    server = create_server(args.directory, args.host, args.port)
+    print(f"フィードを配信しています: http://{args.host}:{server.server_address[1]}/ （{args.directory}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
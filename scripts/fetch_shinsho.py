@@ -6,15 +6,39 @@ import json
 import os
 import requests
 import argparse
-from datetime import datetime
-from typing import Dict, List, Set, Optional
+import multiprocessing
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Set, Optional, Tuple
+
+import book_record
+import data_paths
+import http_client
+import isbn_index
+import json_stream
+import prefix_stats
+import record_index
+import record_refresh
+import record_store
+import response_cache
+import run_metrics
+import scan_state
+import shard
 
 # 定数
 API_BASE_URL = "https://api.openbd.jp/v1"
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
-RECORDS_FILE = os.path.join(DATA_DIR, "shinsho_records.json")
 NEW_RECORDS_FILE = os.path.join(DATA_DIR, "new_shinsho_records.json")
 BATCH_SIZE = 1000  # APIの最大リクエスト数
+STREAM_CHUNK_SIZE = 64 * 1024  # ストリーミング受信時のチャンクサイズ
+OVERLOAD_STATUSES = {429, 503}  # バッチを分割せずに失敗扱いにするHTTPステータス
+BISECT_MAX_RETRIES = 1  # 失敗したバッチを分割して取得し直すときのリトライ回数
+# 「新書」のバイト表現（UTF-8とJSONの\uエスケープ）
+SHINSHO_NEEDLES = ("新書".encode("utf-8"), b"\\u65b0\\u66f8", b"\\u65B0\\u66F8")
+BOOK_START_MARKER = b'{"onix":'  # /getレスポンスの書籍オブジェクトの開始位置
 
 
 def is_shinsho(book_data: Dict, debug_mode: bool = False) -> bool:
@@ -107,75 +131,350 @@ def is_shinsho(book_data: Dict, debug_mode: bool = False) -> bool:
     return False
 
 
-def get_all_isbns() -> List[str]:
+class WarmState:
+    """
+    watchモードで周回をまたいで保持する状態
+    HTTPセッションとバッチサイズの調整状態、既存レコードとそのISBN（文字列と数値）の集合、
+    分類済みインデックス、カバレッジのスナップショット、出版者記号ごとの統計、
+    前回取得したカバレッジとその検証子（ETag / Last-Modified）、
+    カバレッジが前回から変わったか、前回の周回で対象のISBNを処理し終えたかを持つ
+    """
+
+    def __init__(self):
+        self.session: Optional[http_client.PoliteSession] = None
+        self.sizer: Optional[http_client.AdaptiveBatchSizer] = None
+        self.records: Optional[Dict[str, book_record.Record]] = None
+        self.existing_isbns: Set[str] = set()
+        self.existing_values: Set[int] = set()
+        self.seen_isbns: Optional[array] = None
+        self.coverage_snapshot: Optional[array] = None
+        self.prefix_stats: Optional[Dict[str, List[int]]] = None
+        self.coverage: Optional[array] = None
+        self.coverage_validators: Dict[str, str] = {}
+        self.coverage_changed = True
+        self.settled = False
+
+
+def get_all_isbns(session: Optional[requests.Session] = None,
+                  cache: Optional[response_cache.ResponseCache] = None,
+                  warm: Optional[WarmState] = None) -> array:
     """
     openBD APIのカバレッジ情報から全ISBNリストを取得
+    レスポンスを逐次デコードし、数値化したISBNのコンパクトな配列として返す
+    cacheを渡すと条件付きリクエストで再検証し、変更がなければ保存済みの本文を使う
+    warmを渡すと前回取得したカバレッジを条件付きリクエストで再検証し、変更がなければそれを返す
     """
     print("全ISBNリストを取得中...")
-    response = requests.get(f"{API_BASE_URL}/coverage")
-    response.raise_for_status()
+    isbn_list = array("Q")
+    skipped = 0
+    if cache:
+        headers = cache.coverage_headers()
+    elif warm and warm.coverage is not None:
+        headers = {name: value for name, value in (("If-None-Match", warm.coverage_validators.get("ETag")),
+                                                   ("If-Modified-Since", warm.coverage_validators.get("Last-Modified")))
+                   if value}
+    else:
+        headers = {}
+    with (session or requests).get(f"{API_BASE_URL}/coverage", stream=True, headers=headers) as response:
+        if not cache and headers and response.status_code == 304:
+            print(f"カバレッジは前回から変更されていません（総ISBN数: {len(warm.coverage)}）")
+            warm.coverage_changed = False
+            return warm.coverage
+        
+        def counted_chunks():
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                run_metrics.add("bytes_received", len(chunk))
+                yield chunk
+        
+        if cache and response.status_code == 304:
+            print("カバレッジは前回から変更されていません（キャッシュを使用）")
+            chunks = cache.iter_coverage()
+        else:
+            response.raise_for_status()
+            chunks = cache.store_coverage(counted_chunks(), response.headers) if cache else counted_chunks()
+        
+        for isbn in json_stream.iter_json_array(chunks):
+            value = isbn_index.isbn_to_int(isbn) if isinstance(isbn, str) else None
+            if value is None:
+                skipped += 1
+                continue
+            isbn_list.append(value)
+        # 配列の終端より後ろも読み切り、キャッシュへの保存を完了させる
+        for _ in chunks:
+            pass
+        if warm:
+            warm.coverage = isbn_list
+            warm.coverage_changed = True
+            warm.coverage_validators = {name: response.headers[name] for name in ("ETag", "Last-Modified")
+                                        if response.headers.get(name)}
     
-    isbn_list = response.json()
     print(f"総ISBN数: {len(isbn_list)}")
+    if skipped:
+        print(f"ISBN-13として解釈できないため除外: {skipped}件")
     return isbn_list
 
 
-def get_japanese_isbns(all_isbns: List[str]) -> List[str]:
+def get_japanese_isbns(all_isbns: array) -> array:
     """
     日本の書籍のISBNのみをフィルタリング (978-4で始まるもの)
     デバッグモード用
     """
-    jp_isbns = [isbn for isbn in all_isbns if isbn.startswith("978-4") or isbn.startswith("9784")]
+    jp_isbns = array("Q", (value for value in all_isbns if 9784000000000 <= value < 9785000000000))
     print(f"日本の書籍ISBN数: {len(jp_isbns)}")
     return jp_isbns
 
 
-def fetch_books_batch(isbns: List[str]) -> List[Dict]:
+def fetch_books_raw(isbns: List[str], session: Optional[requests.Session] = None,
+                    max_retries: Optional[int] = None) -> bytes:
     """
-    ISBNのバッチで書籍情報を取得
+    ISBNのバッチで書籍情報を取得し、デコード前のレスポンス本文を返す
+    sessionを渡すと接続プールを再利用し、max_retriesでリトライ回数を上書きできる
     """
     isbn_param = ",".join(isbns)
-    response = requests.get(f"{API_BASE_URL}/get", params={"isbn": isbn_param})
+    options = {"max_retries": max_retries} if session is not None and max_retries is not None else {}
+    response = (session or requests).get(f"{API_BASE_URL}/get", params={"isbn": isbn_param}, **options)
     response.raise_for_status()
+    return response.content
+
+
+def iter_books(raw: bytes) -> Iterator[Dict]:
+    """
+    レスポンス本文から書籍情報を1件ずつデコードして返す（Noneは除外）
+    """
+    for book in json_stream.iter_json_array([raw]):
+        if book is not None:
+            yield book
+
+
+def iter_candidate_books(raw: bytes) -> Iterator[Dict]:
+    """
+    レスポンス本文をバイト列のまま書籍ごとに区切り、「新書」を含む書籍のみデコードして返す
+
+    is_shinshoが真になる書籍は必ず本文に「新書」を含むため、含まない書籍は
+    辞書を構築せずに除外できる。区切り位置が想定と異なる場合は、
+    安全のため全件をデコードする。
+    """
+    # 「新書」の出現位置を先に調べ、含まないバッチはデコード自体を省略する
+    positions = []
+    for needle in SHINSHO_NEEDLES:
+        pos = raw.find(needle)
+        while pos != -1:
+            positions.append(pos)
+            pos = raw.find(needle, pos + len(needle))
+    if not positions:
+        return
+
+    # 出現位置の前後にある書籍の開始位置だけを探し、その書籍のみをデコードする
+    decoder = json.JSONDecoder()
+    candidates = []
+    decoded_starts = set()
+    for pos in sorted(positions):
+        start = raw.rfind(BOOK_START_MARKER, 0, pos)
+        if start in decoded_starts:
+            continue
+        book_end = -1
+        if start >= 0:
+            next_start = raw.find(BOOK_START_MARKER, pos)
+            end = raw.rfind(b",", 0, next_start) if next_start != -1 else raw.rfind(b"]")
+            try:
+                text = raw[start:end].decode("utf-8")
+                book, book_end = decoder.raw_decode(text)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+        # 次の書籍までにはnull要素と区切り文字しか残らないはず
+        if book_end < 0 or text[book_end:].replace("null", "").strip(" \t\r\n,"):
+            # 区切り位置が想定と異なる場合は全件デコードにフォールバックする
+            yield from iter_books(raw)
+            return
+        decoded_starts.add(start)
+        candidates.append(book)
+    yield from candidates
+
+
+def fetch_books_adaptive(isbns: List[str], session: requests.Session,
+                         sizer: http_client.AdaptiveBatchSizer) -> Tuple[List[bytes], List[str]]:
+    """
+    ISBNのリストを現在のバッチサイズごとに分けて取得し、(レスポンス本文のリスト, 取得できなかったISBN) を返す
+
+    リトライしてもHTTPエラーになるリクエストは二分割して取得し直し、
+    原因となっているISBNだけを特定して残りを取得する。
+    通信自体が失敗する場合は例外をそのまま送出し、バッチ全体を失敗として扱う。
+    """
+    size = sizer.current()
+    pending = deque((isbns[i:i + size], False) for i in range(0, len(isbns), size))
+    bodies = []
+    failed_isbns = []
+    while pending:
+        chunk, is_split = pending.popleft()
+        start = time.monotonic()
+        try:
+            # 分割後のリクエストは原因の特定が目的なので、リトライは最小限にする
+            raw = fetch_books_raw(chunk, session, max_retries=BISECT_MAX_RETRIES if is_split else None)
+        except requests.HTTPError as e:
+            run_metrics.add("request_errors")
+            sizer.record_failure()
+            if e.response is not None and e.response.status_code in OVERLOAD_STATUSES:
+                # 過負荷や停止中の場合は分割しても負荷を増やすだけなのでバッチごと失敗させる
+                raise
+            if len(chunk) == 1:
+                print(f"取得できないISBNを検出: {chunk[0]} ({http_client.describe_error(e)})")
+                failed_isbns.append(chunk[0])
+                continue
+            middle = len(chunk) // 2
+            pending.appendleft((chunk[middle:], True))
+            pending.appendleft((chunk[:middle], True))
+            continue
+        latency = time.monotonic() - start
+        sizer.record_success(latency)
+        run_metrics.observe("http_request", latency)
+        run_metrics.add("requests")
+        run_metrics.add("bytes_received", len(raw))
+        bodies.append(raw)
+    return bodies, failed_isbns
+
+
+def fetch_books_cached(isbns: List[str], session: requests.Session,
+                       sizer: http_client.AdaptiveBatchSizer,
+                       cache: response_cache.ResponseCache) -> Tuple[List[bytes], List[str]]:
+    """
+    キャッシュにある書籍はディスクから、ないものはAPIから取得し、
+    fetch_books_adaptiveと同じ (レスポンス本文のリスト, 取得できなかったISBN) を返す
+
+    APIから取得した書籍はISBNごとにキャッシュに保存する（openBDにない書籍はnullとして保存）。
+    /get の応答はリクエストしたISBNと同じ順に並ぶため、キャッシュのキーは書籍のRecordReferenceではなく
+    応答内の位置に対応するリクエストのISBNとする（RecordReferenceがリクエストのISBNと異なる書籍もある）。
+    本文はリクエストしたISBNの順に組み立て直すため、判定結果の順序はキャッシュの有無によらない。
+    """
+    elements = cache.get_many(isbns)
+    misses = [isbn for isbn in isbns if isbn not in elements]
+    run_metrics.add("cache_hits", len(elements))
+    run_metrics.add("cache_misses", len(misses))
+    if not misses:
+        return [b"[" + b",".join(elements[isbn] for isbn in isbns) + b"]"], []
+    
+    raw_bodies, failed_isbns = fetch_books_adaptive(misses, session, sizer)
+    # 応答は取得できなかったISBNを除いたリクエストの順に並ぶ（fetch_books_adaptiveは分割しても順序を保つ）
+    failed = set(failed_isbns)
+    requested = [isbn for isbn in misses if isbn not in failed]
+    books = [book for raw in raw_bodies for book in json_stream.iter_json_array([raw])]
+    if len(books) != len(requested):
+        # 件数が合わない場合は位置で対応付けられないため、キャッシュせずに応答をそのまま返す
+        print(f"応答の件数がリクエストと一致しないため、キャッシュしません ({len(books)}件 / {len(requested)}件)")
+        return [b"[" + b",".join(elements[isbn] for isbn in isbns if isbn in elements) + b"]"] + raw_bodies, failed_isbns
+    fetched = {isbn: json.dumps(book, ensure_ascii=False).encode("utf-8") if book is not None else b"null"
+               for isbn, book in zip(requested, books)}
+    cache.put_many(fetched.items())
+    elements.update(fetched)
+    
+    body = b"[" + b",".join(elements[isbn] for isbn in isbns if isbn in elements) + b"]"
+    return [body], failed_isbns
+
+
+def classify_bodies(raw_bodies: List[bytes], debug_mode: bool = False) -> List[Dict]:
+    """
+    レスポンス本文をデコードして新書を判定し、新書の書籍情報のみを抽出して返す
+    プロセスプールのワーカーでも実行できるよう、引数と戻り値はpickle可能な値のみとする
+    """
+    # デバッグモードでは検出されなかった書籍も出力するため全件デコードする
+    decode = iter_books if debug_mode else iter_candidate_books
+    books = run_metrics.timed_iter("decode", (book for raw in raw_bodies for book in decode(raw)))
     
-    books = response.json()
+    shinsho_records = []
+    for book in books:
+        # 高速経路では「新書」を含む候補だけがデコードされるため、バッチの書籍数とは一致しない
+        run_metrics.add("candidates_decoded")
+        if run_metrics.timed("is_shinsho", is_shinsho, book, debug_mode):
+            if book.get("onix", {}).get("RecordReference", ""):
+                shinsho_records.append(run_metrics.timed("extract_book_info", extract_book_info, book))
+    return shinsho_records
+
+
+def classify_bodies_in_worker(raw_bodies: List[bytes], debug_mode: bool = False) -> Tuple[List[Dict], Dict]:
+    """
+    プロセスプールのワーカーで classify_bodies を実行し、新書レコードとこのバッチの性能指標を返す
+    ワーカーの集計は親プロセスに見えないため、バッチごとに初期化して結果と一緒に返す
+    """
+    run_metrics.reset()
+    shinsho_records = classify_bodies(raw_bodies, debug_mode)
+    return shinsho_records, run_metrics.snapshot()
+
+
+def create_parse_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    デコード・判定・抽出を行うプロセスプールを作成（workersが0以下なら作成しない）
+    取得スレッドの実行中に子プロセスを起動するため、forkではなくspawnで起動する
+    """
+    if workers <= 0:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def fetch_books_batch(isbns: List[str], session: Optional[requests.Session] = None) -> List[Dict]:
+    """
+    ISBNのバッチで書籍情報を取得
+    """
     # Noneでない書籍のみ返す
-    return [book for book in books if book is not None]
+    return list(iter_books(fetch_books_raw(isbns, session)))
 
 
-def load_existing_records() -> Dict[str, Dict]:
+def load_existing_records(data_dir: Optional[str] = None) -> Dict[str, book_record.Record]:
     """
-    既存の新書レコードを読み込む
+    既存の新書レコードを読み込む（省メモリのBookRecordとして保持する）
     """
-    if os.path.exists(RECORDS_FILE):
-        with open(RECORDS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    return record_store.load_records(data_dir)
 
 
-def save_records(records: Dict[str, Dict]):
+def save_records(records: List[Dict], data_dir: Optional[str] = None):
     """
-    新書レコードを保存
+    前回の保存以降に追加・更新された新書レコードをレコードストアに追記
     """
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(RECORDS_FILE, "w", encoding="utf-8") as f:
-        json.dump(records, f, ensure_ascii=False, indent=2)
+    record_store.append_records(records, data_dir)
 
 
-def save_new_records(new_records: List[Dict]):
+def save_new_records(new_records: List[Dict], removed_isbns: Optional[List[str]] = None,
+                     updated_records: Optional[List[Dict]] = None, data_dir: Optional[str] = None) -> Dict:
     """
-    新規追加された新書レコードを保存
+    新規追加された新書レコードと、openBDから削除された新書のISBN、
+    再取得で内容が更新された新書レコードを保存
+    保存した内容を、レコードはメモリ上のオブジェクトのまま返す（generate_rss.generate_feed にそのまま渡せる）
     """
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(NEW_RECORDS_FILE, "w", encoding="utf-8") as f:
+    path = data_paths.resolve(NEW_RECORDS_FILE, data_dir)
+    data = {
+        "timestamp": datetime.now().isoformat(),
+        "count": len(new_records),
+        "records": list(new_records),
+        "removed_isbns": list(removed_isbns or []),
+        "updated_records": list(updated_records or [])
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
         json.dump({
-            "timestamp": datetime.now().isoformat(),
-            "count": len(new_records),
-            "records": new_records
+            **data,
+            "records": [book_record.to_plain(record) for record in data["records"]],
+            "updated_records": [book_record.to_plain(record) for record in data["updated_records"]]
         }, f, ensure_ascii=False, indent=2)
+    return data
+
 
+def advance_coverage_snapshot(snapshot: array, added: array, removed: array,
+                              seen_isbns: array, existing_values: Set[int], data_dir: Optional[str] = None) -> array:
+    """
+    今回のカバレッジに合わせてスナップショットを更新して保存する
 
-def extract_book_info(book_data: Dict) -> Dict:
+    追加されたISBNのうち分類済みまたは既存レコードにあるものだけを取り込み、
+    失敗や件数制限で処理されなかったISBNは次回も追加分として扱われるようにする
+    """
+    accounted = [value for value in added
+                 if value in existing_values or isbn_index.contains(seen_isbns, value)]
+    updated = isbn_index.merge(isbn_index.subtract(snapshot, removed), accounted)
+    if updated is not snapshot:
+        # 変化がなければ書き込まない（watchモードでは多くの周回が変化なしになる）
+        # 変化があっても追加・削除分を追記するだけで、スナップショット全体は書き直さない
+        isbn_index.update_coverage_snapshot(updated, accounted, removed, data_dir)
+    return updated
+
+
+def extract_book_info(book_data: Dict) -> book_record.BookRecord:
     """
     書籍情報から必要な情報を抽出
     """
@@ -222,23 +521,62 @@ def extract_book_info(book_data: Dict) -> Dict:
             bio_text = bio.get("content", "") if isinstance(bio, dict) else bio
             
             if name:
-                authors.append({
-                    "name": name,
-                    "role": role,
-                    "bio": bio_text
-                })
-    
-    return {
-        "isbn": isbn,
-        "title": title,
-        "subtitle": subtitle,
-        "collection": collection_info,
-        "authors": authors,
-        "imprint": imprint.get("ImprintName", ""),
-        "publisher": publisher.get("PublisherName", ""),
-        "publishing_date": publishing_date.get("Date", ""),
-        "fetched_at": datetime.now().isoformat()
-    }
+                authors.append(book_record.Author(name, role, bio_text))
+    
+    return book_record.BookRecord(
+        isbn=isbn,
+        title=title,
+        subtitle=subtitle,
+        collection=collection_info,
+        authors=authors,
+        imprint=imprint.get("ImprintName", ""),
+        publisher=publisher.get("PublisherName", ""),
+        publishing_date=publishing_date.get("Date", ""),
+        fetched_at=datetime.now().isoformat()
+    )
+
+
+def refresh_existing_records(records: Dict[str, Dict], session: requests.Session,
+                             sizer: http_client.AdaptiveBatchSizer,
+                             budget: int, workers: int, data_dir: Optional[str] = None) -> List[Dict]:
+    """
+    保存済みの新書レコードのうち最大budget件を再取得し、内容が変わったレコードを返す
+    取得日時（フィードの公開日時）は最初に取得したときの値を引き継ぐ
+    """
+    state = record_refresh.load_refresh_state(data_dir)
+    targets = record_refresh.select_refresh_targets(records, budget, state)
+    if not targets:
+        return []
+    
+    print(f"\n既存レコードを再取得します: {len(targets)}件")
+    changed_records = []
+    failed_isbns = []
+    batches = (targets[i:i + BATCH_SIZE] for i in range(0, len(targets), BATCH_SIZE))
+    results = http_client.fetch_in_order(lambda isbns: fetch_books_adaptive(isbns, session, sizer), batches, workers)
+    for batch_num, (batch_isbns, fetched, fetch_error) in enumerate(results, 1):
+        if fetch_error is not None:
+            # 巡回位置は選択時に進めているため、失敗した分は次回の実行で最初に再取得する
+            print(f"再取得エラー (バッチ {batch_num}): {http_client.describe_error(fetch_error)}")
+            failed_isbns.extend(batch_isbns)
+            continue
+        raw_bodies, batch_failed = fetched
+        failed_isbns.extend(batch_failed)
+        for book in (book for raw in raw_bodies for book in iter_books(raw)):
+            isbn = book.get("onix", {}).get("RecordReference", "")
+            old_record = records.get(isbn)
+            if old_record is None or not is_shinsho(book):
+                continue
+            book_info = extract_book_info(book)
+            book_info["fetched_at"] = old_record.get("fetched_at", book_info["fetched_at"])
+            if record_refresh.content_hash(book_info) != record_refresh.content_hash(old_record):
+                changed_records.append(book_info)
+                print(f"内容の更新を検出: {book_info['title']} (ISBN: {isbn})")
+    
+    if failed_isbns:
+        print(f"再取得できなかったISBN: {len(failed_isbns)}件（次回の実行で最初に再取得します）")
+    state["retry"] = failed_isbns
+    record_refresh.save_refresh_state(state, data_dir)
+    return changed_records
 
 
 def main():
@@ -246,12 +584,48 @@ def main():
     メイン処理
     """
     # コマンドライン引数の解析
-    parser = argparse.ArgumentParser(description='openBD APIから新書データを取得するスクリプト')
+    args = build_arg_parser().parse_args()
+    
+    if args.profile:
+        run_metrics.run_profiled(run, args)
+    else:
+        run(args)
+
+
+def build_arg_parser(description: str = 'openBD APIから新書データを取得するスクリプト') -> argparse.ArgumentParser:
+    """
+    取得処理のコマンドライン引数の定義を返す（pipeline.py でも使う）
+    """
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument('--debug', action='store_true', help='デバッグモードを有効にする')
     parser.add_argument('--limit', type=int, default=None, help='処理するISBN数を制限する（デバッグ用）')
     parser.add_argument('--jp-only', action='store_true', help='日本の書籍のみを処理する')
-    args = parser.parse_args()
-    
+    parser.add_argument('--min-yield', type=float, default=0.0,
+                        help=f'{prefix_stats.PRUNE_MIN_SAMPLES}件以上分類して新書率がこの値未満だった出版者記号のISBNを処理しない（0で無効）')
+    parser.add_argument('--workers', type=int, default=http_client.DEFAULT_WORKERS, help='同時に取得するバッチ数')
+    parser.add_argument('--max-per-host', type=int, default=http_client.DEFAULT_MAX_PER_HOST, help='ホストあたりの同時接続数の上限')
+    parser.add_argument('--rate-limit', type=float, default=http_client.DEFAULT_RATE_LIMIT, help='1秒あたりの最大リクエスト数（0以下で無制限）')
+    parser.add_argument('--max-retries', type=int, default=http_client.DEFAULT_MAX_RETRIES, help='一時的なエラーに対する最大リトライ回数')
+    parser.add_argument('--resume', action='store_true', help='中断された全件スキャンをスキャンカーソルから再開する')
+    parser.add_argument('--time-budget', type=float, default=None, help='指定した分数を超えたら進捗を保存して終了する')
+    parser.add_argument('--refresh', type=int, default=0, help='差分更新時に再取得する既存レコードの最大件数')
+    parser.add_argument('--parse-workers', type=int, default=0, help='デコードと新書判定を行うプロセス数（0でメインプロセスで処理）')
+    parser.add_argument('--cache', action='store_true', help='/get の結果をディスクにキャッシュし、/coverage を条件付きリクエストで取得する（開発用）')
+    parser.add_argument('--cache-max-mb', type=float, default=response_cache.DEFAULT_MAX_MB, help='/get キャッシュの合計サイズの上限（MB）')
+    parser.add_argument('--cache-ttl-days', type=float, default=response_cache.DEFAULT_TTL_DAYS, help='/get キャッシュの有効期間（日）')
+    parser.add_argument('--data-dir', default=None, help='データファイルの保存先ディレクトリ（省略時は data/、ベンチマーク用）')
+    parser.add_argument('--shard', type=shard.parse_shard_spec, default=None, help='全件スキャンをN分割したうちi番目のみ処理する（i/N形式、0始まり）')
+    parser.add_argument('--profile', action='store_true', help='cProfileで実行し、結果をdata/profile.profに保存する')
+    return parser
+
+
+def run(args: argparse.Namespace, warm: Optional[WarmState] = None) -> Optional[Dict]:
+    """
+    新書データの取得処理を実行し、実行レポートを保存する
+    新規レコードファイルに保存した内容を返す（完了済みのシャードや、watchモードでカバレッジが
+    変わらず何もしなかった場合はNone）
+    warmを渡すと、セッションや読み込み済みの状態を次回の実行に引き継ぐ（watchモード用）
+    """
     debug_mode = args.debug
     limit = args.limit
     jp_only = args.jp_only
@@ -263,107 +637,387 @@ def main():
         print("日本の書籍のみを処理します")
     
     start_time = datetime.now()
+    run_metrics.reset()
+    # 周回が途中で失敗した場合に次の周回を省略しないよう、最後まで処理するまでは処理済みとしない
+    previously_settled = bool(warm and warm.settled)
+    if warm:
+        warm.settled = False
+    if warm and warm.session:
+        # 前回の実行の接続とバッチサイズをそのまま使う
+        session, sizer = warm.session, warm.sizer
+    else:
+        session = http_client.create_session(args.workers, args.max_per_host, args.rate_limit, args.max_retries)
+        # 1リクエストあたりのISBN数は応答時間とエラー率に応じて調整する
+        sizer = http_client.AdaptiveBatchSizer(BATCH_SIZE)
+        if warm:
+            warm.session, warm.sizer = session, sizer
+    # 開発時の再実行では、取得済みのレスポンスをキャッシュから再生する
+    cache = response_cache.ResponseCache(max_mb=args.cache_max_mb, ttl_days=args.cache_ttl_days) if args.cache else None
+    if cache:
+        print(f"レスポンスキャッシュを使用します: {cache.directory}")
     
-    # 既存レコードを読み込み
-    existing_records = load_existing_records()
-    existing_isbns = set(existing_records.keys())
+    # 処理順の決定に使う出版者記号ごとの統計（シャードでも data/ の統計を使う）
+    history_stats = prefix_stats.load_prefix_stats(args.data_dir)
+    
+    # データファイルの保存先（シャード指定時はシャードのディレクトリ）
+    data_dir = args.data_dir
+    if args.shard:
+        shard_index, shard_count = args.shard
+        data_dir = shard.shard_dir(shard_index, shard_count)
+        print(f"シャード {shard_index}/{shard_count} を処理します（出力先: {data_dir}）")
+    
+    # 中断された全件スキャンがあれば再開する
+    scan_cursor = None
+    if args.resume:
+        scan_cursor = scan_state.load_scan_state(data_dir)
+        if args.shard and scan_cursor and scan_cursor.get("status") == scan_state.STATUS_COMPLETED:
+            print("このシャードのスキャンは完了済みです。merge_shards.py で統合してください。")
+            return None
+        if scan_cursor and scan_cursor.get("status") != scan_state.STATUS_RUNNING:
+            scan_cursor = None
+        if scan_cursor is None:
+            print("再開可能な全件スキャンはありません。")
+    is_resumed = scan_cursor is not None
+    if args.shard and not is_resumed:
+        # シャードは常に全件スキャンとして最初から実行するため、前回の出力を破棄する
+        shard.clear_shard_dir(data_dir)
+    
+    # 既存レコードを読み込み（watchモードでは前回の実行で更新したものとISBNの集合を使う）
+    if warm and warm.records is not None:
+        existing_records, existing_isbns, existing_values = warm.records, warm.existing_isbns, warm.existing_values
+    else:
+        existing_records = load_existing_records(data_dir)
+        existing_isbns = set(existing_records.keys())
+        existing_values = {isbn_index.isbn_to_int(isbn) for isbn in existing_isbns}
+    
+    # 分類済みISBN（新書以外も含む）のインデックスと前回のカバレッジを読み込み
+    if warm and warm.seen_isbns is not None:
+        seen_isbns, coverage_snapshot = warm.seen_isbns, warm.coverage_snapshot
+    else:
+        seen_isbns = isbn_index.load_seen_isbns(data_dir)
+        coverage_snapshot = isbn_index.load_coverage_snapshot(data_dir)
+    print(f"分類済みISBN数: {len(seen_isbns)}")
     
     # 初回実行か差分更新かを判定
-    is_full_scan = not os.path.exists(RECORDS_FILE) or os.path.getsize(RECORDS_FILE) == 0
-    if is_full_scan:
-        print("データファイルが存在しないため、全件スキャンを実行します。")
+    is_full_scan = is_resumed or args.shard is not None or not record_store.records_exist(data_dir)
+    if is_resumed:
+        print(f"中断された全件スキャンを再開します。既存レコード数: {len(existing_records)}")
+    elif is_full_scan:
+        if args.shard:
+            print("シャードの全件スキャンを実行します。")
+        else:
+            print("データファイルが存在しないため、全件スキャンを実行します。")
         print("処理には数時間かかる場合があります。")
+        # 全件スキャンでは全ISBNを分類し直すため、分類済みインデックスとスナップショットを空にする
+        seen_isbns = array("Q")
+        isbn_index.save_seen_isbns(seen_isbns, data_dir)
+        coverage_snapshot = array("Q")
+        isbn_index.save_coverage_snapshot(coverage_snapshot, data_dir)
     else:
         print(f"差分更新を実行します。既存レコード数: {len(existing_records)}")
     
+    # 出版者記号ごとの統計を読み込み（全件スキャンでは分類済みインデックスと同様に数え直す）
+    if is_full_scan and not is_resumed:
+        stats = {}
+        prefix_stats.save_prefix_stats(stats, data_dir)
+    else:
+        stats = warm.prefix_stats if warm and warm.prefix_stats is not None else prefix_stats.load_prefix_stats(data_dir)
+        if stats is None:
+            # 統計ファイルがなければ分類済みインデックスと既存レコードから作る
+            stats = prefix_stats.build_prefix_stats(seen_isbns, existing_values)
+            prefix_stats.save_prefix_stats(stats, data_dir)
+            print(f"出版者記号ごとの統計を作成しました: {len(stats)}件")
+    stats_changed = False
+    # 全件スキャンの処理順は開始時の統計で決め、再開してもバッチ番号が対応するようカーソルに保存する
+    if is_resumed:
+        priority_stats = scan_cursor.get("prefix_stats", {})
+    elif is_full_scan:
+        priority_stats = history_stats or {}
+    else:
+        priority_stats = stats
+    
     # 全ISBNリストを取得
     print("openBDからISBNリストを取得中...")
-    all_isbns = get_all_isbns()
+    with run_metrics.stage("coverage"):
+        all_isbns = get_all_isbns(session, cache, warm)
+    if previously_settled and not warm.coverage_changed and not args.refresh:
+        # 前回の周回で対象を処理し終えていれば、同じカバレッジから新たに処理するISBNはない
+        # 差分の計算も保存も行わず、フィードの生成も省略させる
+        if cache:
+            cache.close()
+        warm.settled = True
+        print("前回の周回から変化がないため、処理を省略します。")
+        return None
+    if args.shard:
+        all_isbns = shard.filter_shard(all_isbns, shard_index, shard_count)
+        print(f"このシャードのISBN数: {len(all_isbns)}")
+    
+    # 前回のスナップショットと比較して追加・削除されたISBNを求める
+    added_isbns, removed_isbns = isbn_index.diff_snapshot(coverage_snapshot, all_isbns)
+    removed_records = [isbn for isbn in map(isbn_index.int_to_isbn, removed_isbns) if isbn in existing_isbns]
+    print(f"前回のカバレッジからの変化: 追加 {len(added_isbns)}件, 削除 {len(removed_isbns)}件 (うち新書 {len(removed_records)}件)")
     
     # これから処理するISBNリストを決定
     if is_full_scan:
         target_isbns = all_isbns
         print(f"全件スキャン対象: {len(target_isbns)}件")
     else:
-        all_isbns_set = set(all_isbns)
-        target_isbns = list(all_isbns_set - existing_isbns)
-        print(f"差分更新対象: {len(target_isbns)}件 (全体: {len(all_isbns)}件, 既存: {len(existing_isbns)}件)")
+        # 追加されたISBNのうち、新書レコードと分類済みインデックスのどちらにもないものを対象にする
+        target_isbns = isbn_index.filter_unseen(
+            (value for value in added_isbns if value not in existing_values), seen_isbns
+        )
+        print(f"差分更新対象: {len(target_isbns)}件 (全体: {len(all_isbns)}件, 既存: {len(existing_isbns)}件, 分類済み: {len(seen_isbns)}件)")
 
     # 日本の書籍のみに絞り込み
     if jp_only:
         target_isbns = get_japanese_isbns(target_isbns)
     
+    # 新書率の低い出版者記号を除外し、新書率の高い出版者記号から処理する
+    if args.min_yield > 0:
+        target_isbns = prefix_stats.prune(target_isbns, priority_stats, args.min_yield)
+    target_isbns = prefix_stats.prioritize(target_isbns, priority_stats)
+    
     # デバッグモードでサンプル数を制限
+    truncated = bool(limit) and len(target_isbns) > limit
     if limit:
         print(f"指定された上限({limit}件)までのISBNのみ処理します")
         target_isbns = target_isbns[:limit]
     
     if not target_isbns:
         print("処理対象の新しいISBNはありませんでした。")
-        save_new_records([]) # 空のレコードを保存してタイムスタンプを更新
-        print("処理を終了します。")
-        return
+
+    # 全件スキャンの進捗はスキャンカーソルに記録する
+    total_batches = (len(target_isbns) + BATCH_SIZE - 1) // BATCH_SIZE
+    if is_full_scan:
+        snapshot_id = scan_state.compute_snapshot_id(target_isbns)
+        options = {"jp_only": jp_only, "limit": limit, "min_yield": args.min_yield}
+        if is_resumed and (scan_cursor["snapshot_id"] != snapshot_id
+                           or scan_cursor["batch_size"] != BATCH_SIZE
+                           or scan_cursor["options"] != options):
+            # カバレッジが変わった場合はバッチ番号が対応しないため、
+            # このスキャンで分類済みのISBNを除外しながら新しいカーソルで続行する
+            print("前回からカバレッジが変化したため、未分類のISBNのみを対象に再開します。")
+            scan_cursor = None
+        if scan_cursor is None:
+            scan_cursor = scan_state.new_scan_state(snapshot_id, total_batches, BATCH_SIZE, options)
+            scan_cursor["prefix_stats"] = priority_stats
+        else:
+            print(f"完了済みバッチ: {scan_state.completed_count(scan_cursor)}/{total_batches}, "
+                  f"再試行するバッチ: {len(scan_cursor['failed'])}")
+        scan_state.save_scan_state(scan_cursor, data_dir)
+        batch_plan = scan_state.pending_batches(scan_cursor)
+    else:
+        batch_plan = list(range(total_batches))
 
     # 新しい新書レコード
     new_shinsho_records = []
-    updated_records = existing_records.copy()
+    unsaved_records = []  # 前回の保存以降に見つかったレコード
+    # 既存レコードの辞書をそのまま更新する（既存かどうかの判定にはexisting_isbnsを使う）
+    updated_records = existing_records
     
     # バッチ処理
-    total_batches = (len(target_isbns) + BATCH_SIZE - 1) // BATCH_SIZE
     processed_count = 0
     error_count = 0
+    failed_isbn_count = 0
+    classified_isbns = []  # 次回以降の差分更新で除外する分類済みISBN（前回の中間保存以降の分）
+    saved_classified = array("Q")  # 中間保存でインデックスに追記済みの分類済みISBN
+    interrupted = False
+    deadline = start_time + timedelta(minutes=args.time_budget) if args.time_budget else None
+    
+    def plan_batches():
+        for batch_index in batch_plan:
+            batch_isbns = target_isbns[batch_index * BATCH_SIZE:(batch_index + 1) * BATCH_SIZE]
+            if is_resumed:
+                # 再開時はこのスキャンで分類済みのISBNを除外する
+                batch_isbns = isbn_index.filter_unseen(batch_isbns, seen_isbns)
+            yield batch_index, batch_isbns
+    
+    # 指定があればデコード・判定・抽出をプロセスプールで並列に行う
+    parse_pool = create_parse_pool(args.parse_workers)
     
-    for i in range(0, len(target_isbns), BATCH_SIZE):
-        batch_isbns = target_isbns[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
+    def fetch_planned(batch):
+        batch_isbns = batch[1]
+        isbns = list(map(isbn_index.int_to_isbn, batch_isbns))
+        run_metrics.add("books_requested", len(isbns))
+        if cache:
+            raw_bodies, failed_isbns = run_metrics.timed("fetch_batch", fetch_books_cached, isbns, session, sizer, cache)
+        else:
+            raw_bodies, failed_isbns = run_metrics.timed("fetch_batch", fetch_books_adaptive, isbns, session, sizer)
+        if parse_pool is not None:
+            # 受信した本文はすぐにプロセスプールへ渡し、抽出済みの新書レコードだけを受け取る
+            return parse_pool.submit(classify_bodies_in_worker, raw_bodies, debug_mode), failed_isbns
+        # プロセスプールを使わない場合、デコードは処理時にメインスレッドで行う
+        return raw_bodies, failed_isbns
+    
+    # 複数バッチを並行して取得し、結果は投入順に処理する
+    results = http_client.fetch_in_order(fetch_planned, plan_batches(), args.workers)
+    
+    for batch_num, ((batch_index, batch_isbns), fetched, fetch_error) in enumerate(results, 1):
+        if deadline and datetime.now() >= deadline:
+            print(f"\n制限時間({args.time_budget}分)に達したため、進捗を保存して終了します。")
+            interrupted = True
+            break
         
         # より詳細な進捗表示
         elapsed = (datetime.now() - start_time).total_seconds()
-        print(f"\nバッチ {batch_num}/{total_batches} を処理中... (経過時間: {elapsed:.1f}秒)")
+        print(f"\nバッチ {batch_num}/{len(batch_plan)} を処理中... (経過時間: {elapsed:.1f}秒)")
+        batch_start = time.perf_counter()
         
         try:
-            books = fetch_books_batch(batch_isbns)
+            if fetch_error is not None:
+                raise fetch_error
+            parsed, failed_isbns = fetched
+            if parse_pool is not None:
+                # 結果はバッチの投入順に受け取るため、出力の順序は並列数によらない
+                shinsho_records, worker_metrics = run_metrics.timed("parse_wait", parsed.result)
+                # ワーカーで計測したデコード・判定・抽出の指標を実行レポートに含める
+                run_metrics.merge(worker_metrics)
+            else:
+                shinsho_records = classify_bodies(parsed, debug_mode)
             
-            for book in books:
-                if is_shinsho(book, debug_mode):
-                    isbn = book.get("onix", {}).get("RecordReference", "")
-                    # 全件スキャン時は既存チェック不要、差分更新時は必要
-                    if isbn and (is_full_scan or isbn not in existing_isbns):
-                        book_info = extract_book_info(book)
-                        new_shinsho_records.append(book_info)
-                        updated_records[isbn] = book_info
-                        if not is_full_scan:
-                             # 差分更新の時だけログを出すと見やすい
-                            print(f"新規新書発見: {book_info['title']} (ISBN: {isbn})")
+            for book_info in shinsho_records:
+                isbn = book_info["isbn"]
+                # 全件スキャン時は既存チェック不要、差分更新時は必要
+                if is_full_scan or isbn not in existing_isbns:
+                    run_metrics.add("records_extracted")
+                    new_shinsho_records.append(book_info)
+                    unsaved_records.append(book_info)
+                    updated_records[isbn] = book_info
+                    if not is_full_scan:
+                         # 差分更新の時だけログを出すと見やすい
+                        print(f"新規新書発見: {book_info['title']} (ISBN: {isbn})")
 
+            # 取得できなかったISBNは分類済みにせず、次回以降に再取得する
+            if failed_isbns:
+                failed_values = set(map(isbn_index.isbn_to_int, failed_isbns))
+                failed_isbn_count += len(failed_values)
+                batch_isbns = [value for value in batch_isbns if value not in failed_values]
             processed_count += len(batch_isbns)
+            run_metrics.add("isbns_processed", len(batch_isbns))
+            classified_isbns.extend(batch_isbns)
+            prefix_stats.add_counts(stats, batch_isbns,
+                                    (isbn_index.isbn_to_int(book_info["isbn"]) for book_info in shinsho_records))
+            stats_changed = stats_changed or bool(batch_isbns)
+            if is_full_scan:
+                scan_state.mark_completed(scan_cursor, batch_index)
             
         except Exception as e:
             error_count += 1
-            print(f"エラー発生 (バッチ {batch_num}): {str(e)}")
+            print(f"エラー発生 (バッチ {batch_num}): {http_client.describe_error(e)}")
+            if is_full_scan:
+                # 失敗したバッチは次回の再開時に再試行する
+                scan_state.mark_failed(scan_cursor, batch_index)
+        run_metrics.observe("process_batch", time.perf_counter() - batch_start)
         
-        # 50バッチごとに中間保存
+        # 50バッチごとに中間保存（前回の中間保存以降の差分とスキャンカーソルのみ書き込む）
+        # 新規レコードファイルは次の実行で作り直されるため、最後に1回だけ保存する
         if batch_num > 0 and batch_num % 50 == 0:
-            save_records(updated_records)
-            save_new_records(new_shinsho_records)
+            with run_metrics.stage("save_records"):
+                save_records(unsaved_records, data_dir)
+                unsaved_records = []
+            with run_metrics.stage("save_index"):
+                # 中間保存では前回以降に分類したISBNだけを追記し、インデックス全体は書き直さない
+                isbn_index.add_seen_isbns(classified_isbns, data_dir)
+                saved_classified.extend(classified_isbns)
+                classified_isbns = []
+                if stats_changed:
+                    prefix_stats.save_prefix_stats(stats, data_dir)
+                    stats_changed = False
+            # カーソルはレコードの保存後に更新し、未保存のバッチを完了扱いにしない
+            if is_full_scan:
+                scan_state.save_scan_state(scan_cursor, data_dir)
             print(f"中間保存を実行しました（新規{len(new_shinsho_records)}件, 合計{len(updated_records)}件）")
+    results.close()
+    if parse_pool is not None:
+        parse_pool.shutdown(cancel_futures=True)
+    if cache:
+        cache.close()
+    
+    # 差分更新では既存レコードの一部を再取得して内容の変更を反映する
+    refreshed_records = []
+    if args.refresh and not is_full_scan and not interrupted:
+        with run_metrics.stage("refresh"):
+            refreshed_records = refresh_existing_records(updated_records, session, sizer, args.refresh, args.workers,
+                                                         data_dir)
+        for book_info in refreshed_records:
+            updated_records[book_info["isbn"]] = book_info
+        unsaved_records.extend(refreshed_records)
     
     # 最終的な結果を保存
-    save_records(updated_records)
-    save_new_records(new_shinsho_records)
+    with run_metrics.stage("save_records"):
+        save_records(unsaved_records, data_dir)
+        new_records_data = save_new_records(new_shinsho_records, removed_records, refreshed_records,
+                                            data_dir=data_dir)
+        # query_records.py 用の二次インデックスがあれば、追記したレコードを反映する
+        record_index.update_if_present(data_dir)
+    with run_metrics.stage("save_index"):
+        merged_isbns = isbn_index.merge(seen_isbns, saved_classified + array("Q", classified_isbns))
+        if merged_isbns is not seen_isbns:
+            # 分類済みISBNが増えた場合のみ残りを追記し、セグメントが増えすぎていれば最後に1回だけ書き直す
+            seen_isbns = merged_isbns
+            if isbn_index.add_seen_isbns(classified_isbns, data_dir) > isbn_index.MAX_SEGMENTS:
+                isbn_index.save_seen_isbns(seen_isbns, data_dir)
+        coverage_snapshot = advance_coverage_snapshot(
+            coverage_snapshot, added_isbns, removed_isbns, seen_isbns, existing_values, data_dir
+        )
+        if stats_changed:
+            prefix_stats.save_prefix_stats(stats, data_dir)
+    if is_full_scan:
+        if not scan_state.pending_batches(scan_cursor):
+            scan_cursor["status"] = scan_state.STATUS_COMPLETED
+        scan_state.save_scan_state(scan_cursor, data_dir)
+    if warm:
+        # 既存レコードのISBNの集合は作り直さず、今回追加したレコードの分だけ加える
+        existing_isbns.update(book_info["isbn"] for book_info in new_shinsho_records)
+        existing_values.update(isbn_index.isbn_to_int(book_info["isbn"]) for book_info in new_shinsho_records)
+        warm.records, warm.existing_isbns, warm.existing_values = updated_records, existing_isbns, existing_values
+        warm.seen_isbns, warm.coverage_snapshot = seen_isbns, coverage_snapshot
+        warm.prefix_stats = stats
+        # 取得できなかったISBNや未処理のISBNが残っていれば、カバレッジが同じでも次の周回で処理する
+        warm.settled = not (interrupted or truncated or error_count or failed_isbn_count)
     
     # 処理時間を計算
     elapsed_seconds = (datetime.now() - start_time).total_seconds()
     elapsed_minutes = elapsed_seconds / 60
     
-    print("\n処理完了:")
-    print(f"- 処理モード: {'全件スキャン' if is_full_scan else '差分更新'}")
+    print("\n処理完了:" if not interrupted else "\n処理中断:")
+    print(f"- 処理モード: {'全件スキャン' if is_full_scan else '差分更新'}{'（再開）' if is_resumed else ''}")
     print(f"- 処理時間: {elapsed_minutes:.1f}分")
     print(f"- 処理したISBN数: {processed_count}")
     print(f"- 新規新書数: {len(new_shinsho_records)}")
     print(f"- エラー数: {error_count}")
+    print(f"- 取得できなかったISBN数: {failed_isbn_count}")
+    print(f"- 最終的な1リクエストあたりのISBN数: {sizer.current()}")
     print(f"- 保存された新書総数: {len(updated_records)}")
+    print(f"- 分類済みISBN総数: {len(seen_isbns)}")
+    print(f"- カバレッジから削除された新書数: {len(removed_records)}")
+    print(f"- 再取得で更新された新書数: {len(refreshed_records)}")
+    if is_full_scan:
+        remaining = len(scan_state.pending_batches(scan_cursor))
+        print(f"- 未完了バッチ数: {remaining}{'（--resume で再開できます）' if remaining else ''}")
+    
+    # 実行レポートを保存
+    report = run_metrics.build_report({
+        "mode": "full_scan" if is_full_scan else "diff",
+        "resumed": is_resumed,
+        "interrupted": interrupted,
+        "options": dict(vars(args)),
+        "result": {
+            "processed_isbns": processed_count,
+            "new_records": len(new_shinsho_records),
+            "errors": error_count,
+            "failed_isbns": failed_isbn_count,
+            "final_batch_size": sizer.current(),
+            "total_records": len(updated_records),
+            "removed_records": len(removed_records),
+            "refreshed_records": len(refreshed_records)
+        }
+    })
+    run_metrics.save_report(report, data_dir)
+    print(f"- ピークメモリ: {report['peak_memory_mb']}MB")
+    print(f"- 受信データ量: {report['counters'].get('bytes_received', 0) / 1024 / 1024:.1f}MB")
     print("データ保存完了")
+    return new_records_data
 
 
 if __name__ == "__main__":
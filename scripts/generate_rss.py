@@ -2,12 +2,20 @@
 """
 新規新書データからRSSフィードを生成するスクリプト
 """
+import argparse
+import functools
+import gzip
+import hashlib
 import json
 import os
 from datetime import datetime, timezone, timedelta
-from feedgen.feed import FeedGenerator
-from dateutil import parser as date_parser
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+import book_record
+import feed_archive
+import feed_groups
+import feed_order
+import search_index
 
 # 定数
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
@@ -16,7 +24,10 @@ NEW_RECORDS_FILE = os.path.join(DATA_DIR, "new_shinsho_records.json")
 FEED_FILE = os.path.join(DOCS_DIR, "index.xml")
 SITE_URL = "https://analekt.github.io/shinsho"  # GitHubユーザー名に置き換える
 FEED_HISTORY_FILE = os.path.join(DATA_DIR, "feed_history.json")
-MAX_FEED_ENTRIES = 50  # フィードに保持する最大エントリー数
+MAX_FEED_ENTRIES = 50  # フィードに保持するエントリー数（全体のフィードではあふれた分をアーカイブページに移す）
+FEED_TITLE = "新書新刊情報 - openBD"
+FEED_SUBTITLE = "openBD APIから取得した新書の新刊情報を配信します"
+FEED_STATE_FILE = os.path.join(DATA_DIR, "feed_state.json")  # 生成済みフィードの内容のハッシュと更新日時
 
 
 def format_authors(authors: List[Dict]) -> str:
@@ -112,7 +123,7 @@ def load_feed_history() -> List[Dict]:
     """
     if os.path.exists(FEED_HISTORY_FILE):
         with open(FEED_HISTORY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            return [book_record.compact_record(entry) for entry in json.load(f)]
     return []
 
 
@@ -122,14 +133,32 @@ def save_feed_history(entries: List[Dict]):
     """
     os.makedirs(DATA_DIR, exist_ok=True)
     with open(FEED_HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(entries, f, ensure_ascii=False, indent=2)
+        json.dump([book_record.to_plain(entry) for entry in entries], f, ensure_ascii=False, indent=2)
 
 
-def generate_feed():
+def load_feed_state() -> Dict[str, Dict]:
     """
-    RSSフィードを生成
+    生成済みフィードの内容のハッシュと更新日時を読み込む
+    """
+    if os.path.exists(FEED_STATE_FILE):
+        with open(FEED_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_feed_state(feed_state: Dict[str, Dict]):
+    """
+    生成済みフィードの内容のハッシュと更新日時を保存
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(FEED_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(feed_state.items())), f, ensure_ascii=False, indent=2)
+
+
+def load_new_records() -> Dict:
+    """
+    新規レコードファイルを読み込む（なければ空のファイルを作成する）
     """
-    # 新規レコードを読み込む
     if not os.path.exists(NEW_RECORDS_FILE):
         print("新規レコードファイルが見つかりません - 空のフィードを生成します")
         # 空のデータで初期化
@@ -145,8 +174,21 @@ def generate_feed():
     else:
         with open(NEW_RECORDS_FILE, "r", encoding="utf-8") as f:
             data = json.load(f)
+    return data
+
+
+def generate_feed(order: str = feed_order.DEFAULT_ORDER_POLICY, data: Optional[Dict] = None):
+    """
+    RSSフィードを生成
+    orderはフィードの並び順（fetched: 取得順、published: 出版日順）
+    dataには新規レコードファイルと同じ形式の取得結果を渡せる（省略時はファイルから読み込む）
+    """
+    # 新規レコードを読み込む
+    if data is None:
+        data = load_new_records()
     
-    new_records = data.get("records", [])
+    new_records = [book_record.compact_record(record) for record in data.get("records", [])]
+    removed_isbns = set(data.get("removed_isbns", []))
     timestamp = data.get("timestamp", datetime.now(timezone.utc).isoformat())
     
     print(f"新規レコード数: {len(new_records)}")
@@ -155,39 +197,127 @@ def generate_feed():
     feed_history = load_feed_history()
     print(f"既存のフィード履歴: {len(feed_history)}件")
     
-    # 新規レコードを履歴に追加（最新のものを先頭に）
-    for book in new_records:
-        # 重複チェック
-        if not any(entry.get("isbn") == book.get("isbn") for entry in feed_history):
-            feed_history.insert(0, book)
+    # openBDから削除された書籍はフィードからも取り下げ、
+    # 再取得で内容が更新された書籍は、フィード上の位置を変えずに内容を差し替える
+    updated_records = {book.get("isbn"): book_record.compact_record(book) for book in data.get("updated_records", [])}
+    feed_history, modified = feed_order.apply_changes(feed_history, removed_isbns, updated_records, order)
+    if removed_isbns:
+        print(f"削除された書籍を取り下げた後のフィード履歴: {len(feed_history)}件")
+    
+    # 出版日順に切り替えた直後は、新規レコードがなくても既存の履歴が並べ直される
+    reordered = order == "published" and not feed_order.is_sorted_desc(feed_history, feed_order.publication_key)
+    
+    # 新規レコードを指定した並び順で履歴に追加
+    # アーカイブ済みの書籍も重複とみなすため、同じ新規レコードで再実行しても再び先頭に戻らない
+    archive_state = feed_archive.load_archive_state()
+    feed_history, added_count = feed_order.merge_new_records(
+        feed_history, new_records, order, exclude=archive_state["isbns"])
+    print(f"フィードに追加した新規レコード数: {added_count}件")
+    
+    # 最新のフィードからあふれた古いエントリーをアーカイブページに書き出す（既存のページは変更しない）
+    feed_state = load_feed_state()
+    feed_history, archive_pages = feed_archive.split_archive_pages(feed_history, MAX_FEED_ENTRIES)
+    for entries in archive_pages:
+        archive_state["pages"] += 1
+        page = archive_state["pages"]
+        write_feed(entries, feed_archive.archive_path(page), feed_archive.archive_url(SITE_URL, page),
+                   f"{FEED_TITLE}（アーカイブ {page}）", FEED_SUBTITLE, timestamp, feed_state,
+                   links=feed_archive.page_links(SITE_URL, f"{SITE_URL}/index.xml", page, archive_state["pages"]),
+                   archive=True)
+        archive_state["isbns"].extend(entry.get("isbn") for entry in entries)
+    if archive_pages:
+        feed_archive.save_archive_state(archive_state)
+        print(f"アーカイブページを{len(archive_pages)}件追加しました（合計{archive_state['pages']}件）")
+    
+    # フィード履歴は変更があった場合のみ保存する（全体のフィードはwrite_feedが入力のハッシュで判定する）
+    if modified or reordered or added_count or archive_pages or not os.path.exists(FEED_HISTORY_FILE):
+        save_feed_history(feed_history)
+    
+    # シリーズ別・出版社別のフィード履歴にも同じ変更を反映する
+    group_history = feed_groups.load_group_history()
+    changed_groups = feed_groups.update_group_history(
+        group_history, new_records, removed_isbns, updated_records, MAX_FEED_ENTRIES, order)
+    feed_groups.save_group_history(group_history)
+    
+    # 全体のフィードを保存（内容が変わらなければファイルはそのまま）
+    if write_feed(feed_history, FEED_FILE, f"{SITE_URL}/index.xml", FEED_TITLE, FEED_SUBTITLE, timestamp, feed_state,
+                  links=feed_archive.page_links(SITE_URL, f"{SITE_URL}/index.xml", None, archive_state["pages"])):
+        print(f"RSSフィードを生成しました: {FEED_FILE}")
+    else:
+        print(f"フィードの内容に変更がないため更新しません: {FEED_FILE}")
+    print(f"フィードのエントリー数: {len(feed_history)}")
     
-    # 最大エントリー数を制限
-    feed_history = feed_history[:MAX_FEED_ENTRIES]
+    # エントリーが変わったグループのフィードのみ書き直す（未生成のものも作成する）
+    rendered = 0
+    for kind, groups in group_history.items():
+        for name, entries in groups.items():
+            path = feed_groups.feed_path(kind, name)
+            if (kind, name) not in changed_groups and os.path.exists(path):
+                continue
+            if write_feed(entries, path, feed_groups.feed_url(SITE_URL, kind, name), feed_groups.feed_title(kind, name),
+                          feed_groups.feed_subtitle(kind, name), timestamp, feed_state):
+                rendered += 1
+    removed = [key for key in changed_groups if key[1] not in group_history.get(key[0], {})]
+    for kind, name in removed:
+        feed_state.pop(feed_state_key(feed_groups.remove_feed(kind, name)), None)
+    save_feed_state(feed_state)
+    index_written = feed_groups.write_index(group_history, SITE_URL)
+    group_count = sum(len(groups) for groups in group_history.values())
+    print(f"シリーズ別・出版社別フィード: {group_count}件中{rendered}件を生成、{len(removed)}件を削除"
+          f"{'（一覧を更新）' if index_written else ''}")
     
-    # フィード履歴を保存
-    save_feed_history(feed_history)
+    # 検索インデックスは変更のあった書籍のbigramを含むシャードだけを書き直す
+    search_result = search_index.update_search_index(new_records, removed_isbns, updated_records.values())
+    print(f"検索インデックス: {search_result['docs']}件（bigramのシャード{search_result['term_shards']}件、"
+          f"書籍のシャード{search_result['doc_shards']}件を更新）")
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    ISO 8601形式の日時を読み込む（タイムゾーンがなければJSTとみなす）
+    このプロジェクトが出力する日時はdatetime.fromisoformatで読み、それ以外の形式のみdateutilを使う
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil import parser as date_parser
+        parsed = date_parser.parse(value)
+    if parsed.tzinfo is None:
+        # JSTタイムゾーンを追加（UTC+9）
+        parsed = parsed.replace(tzinfo=timezone(timedelta(hours=9)))
+    return parsed
+
+
+def render_feed(entries: List[Dict], feed_url: str, title: str, subtitle: str, build_date: str,
+                links: Optional[List[Tuple[str, str]]] = None, archive: bool = False) -> bytes:
+    """
+    エントリーからRSSフィードを生成
+    同じエントリーと更新日時からは常に同じバイト列になる
+    linksにはRFC 5005のページングのリンク、archiveにはアーカイブページかどうかを指定する
+    """
+    # feedgen（lxml）の読み込みは重いため、実際にフィードを生成するときだけ読み込む
+    from feedgen.feed import FeedGenerator
     
     # フィードジェネレーターを作成
     fg = FeedGenerator()
-    fg.id(f"{SITE_URL}/index.xml")
-    fg.title("新書新刊情報 - openBD")
+    fg.id(feed_url)
+    fg.title(title)
     fg.author({"name": "openBD新書フィード", "email": "noreply@example.com"})
     fg.link(href=SITE_URL, rel="alternate")
-    fg.link(href=f"{SITE_URL}/index.xml", rel="self")
-    fg.subtitle("openBD APIから取得した新書の新刊情報を配信します")
+    fg.link(href=feed_url, rel="self")
+    fg.subtitle(subtitle)
     fg.language("ja")
-    # タイムゾーン付きの日時を設定
+    if links or archive:
+        feed_archive.register(fg, links or [], archive)
+    # タイムゾーン付きの日時を設定（実行時刻ではなく内容が変わった時点の日時）
     try:
-        build_datetime = date_parser.parse(timestamp)
-        if build_datetime.tzinfo is None:
-            # JSTタイムゾーンを追加（UTC+9）
-            build_datetime = build_datetime.replace(tzinfo=timezone(timedelta(hours=9)))
-        fg.lastBuildDate(build_datetime)
+        build_datetime = parse_datetime(build_date)
     except:
-        fg.lastBuildDate(datetime.now(timezone.utc))
+        build_datetime = datetime.now(timezone.utc)
+    fg.lastBuildDate(build_datetime)
     
     # フィード履歴からエントリーを生成
-    for book in feed_history:
+    for book in entries:
         fe = fg.add_entry()
         
         # ID（ISBN）
@@ -215,16 +345,12 @@ def generate_feed():
         description = create_description(book)
         fe.description(description)
         
-        # 公開日時
-        fetched_at = book.get("fetched_at", timestamp)
+        # 公開日時（取得日時がなければフィードの更新日時）
+        fetched_at = book.get("fetched_at")
         try:
-            pub_datetime = date_parser.parse(fetched_at)
-            if pub_datetime.tzinfo is None:
-                # JSTタイムゾーンを追加（UTC+9）
-                pub_datetime = pub_datetime.replace(tzinfo=timezone(timedelta(hours=9)))
-            fe.published(pub_datetime)
+            fe.published(parse_datetime(fetched_at) if fetched_at else build_datetime)
         except:
-            fe.published(datetime.now(timezone.utc))
+            fe.published(build_datetime)
         
         # カテゴリー（新書）
         fe.category(term="新書", label="新書")
@@ -234,19 +360,82 @@ def generate_feed():
         if collection:
             fe.category(term=collection, label=collection)
     
-    # フィードを保存
-    os.makedirs(DOCS_DIR, exist_ok=True)
-    fg.rss_file(FEED_FILE, pretty=True)
-    print(f"RSSフィードを生成しました: {FEED_FILE}")
-    print(f"フィードのエントリー数: {len(feed_history)}")
+    return fg.rss_str(pretty=True)
+
+
+def feed_state_key(path: str) -> str:
+    """
+    フィードの状態を記録するキー（docsからの相対パス）を返す
+    """
+    return os.path.relpath(path, DOCS_DIR).replace(os.sep, "/")
+
+
+@functools.lru_cache(maxsize=None)
+def renderer_fingerprint() -> str:
+    """
+    フィードの生成処理（このファイル）のハッシュを返す
+    生成処理を変更したときに、入力が同じフィードも生成し直すために使う
+    """
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def feed_source_hash(entries: List[Dict], feed_url: str, title: str, subtitle: str,
+                     links: Optional[List[Tuple[str, str]]], archive: bool) -> str:
+    """
+    フィードの生成に使う入力（エントリー・メタデータ・生成処理）のハッシュを返す
+    """
+    source = json.dumps({
+        "renderer": renderer_fingerprint(),
+        "feed": [feed_url, title, subtitle, links or [], archive],
+        "entries": [book_record.to_plain(entry) for entry in entries]
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def write_feed(entries: List[Dict], path: str, feed_url: str, title: str, subtitle: str,
+               timestamp: str, feed_state: Dict[str, Dict],
+               links: Optional[List[Tuple[str, str]]] = None, archive: bool = False) -> bool:
+    """
+    RSSフィードとgzip圧縮版を保存し、書き換えたかを返す
+    入力が前回と同じならフィードを生成せず、入力が変わっても前回の更新日時で生成した内容が
+    前回のハッシュと一致すれば、ファイルには触れない
+    内容が変わった場合のみ更新日時をtimestampに進める
+    """
+    key = feed_state_key(path)
+    previous = feed_state.get(key)
+    source_hash = feed_source_hash(entries, feed_url, title, subtitle, links, archive)
+    if previous and os.path.exists(path) and os.path.exists(f"{path}.gz"):
+        if previous.get("source_sha256") == source_hash:
+            return False
+        content = render_feed(entries, feed_url, title, subtitle, previous["last_build_date"], links, archive)
+        if hashlib.sha256(content).hexdigest() == previous["sha256"]:
+            previous["source_sha256"] = source_hash
+            return False
+    
+    content = render_feed(entries, feed_url, title, subtitle, timestamp, links, archive)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for target, data in ((path, content), (f"{path}.gz", gzip.compress(content, mtime=0))):
+        tmp_path = f"{target}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    feed_state[key] = {"sha256": hashlib.sha256(content).hexdigest(), "source_sha256": source_hash,
+                       "last_build_date": timestamp}
+    return True
 
 
 def main():
     """
     メイン処理
     """
+    parser = argparse.ArgumentParser(description="新規新書データからRSSフィードを生成します。")
+    parser.add_argument("--order", choices=feed_order.ORDER_POLICIES, default=feed_order.DEFAULT_ORDER_POLICY,
+                        help="フィードの並び順（fetched: 取得した順、published: 出版日の新しい順）")
+    args = parser.parse_args()
+    
     print("RSSフィード生成を開始します...")
-    generate_feed()
+    generate_feed(args.order)
     print("完了しました")
 
 
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+openBD APIへのHTTPアクセスを扱うモジュール
+
+keep-aliveの接続プールを共有するセッションと、複数バッチを並行して取得しつつ
+投入順に結果を返すフェッチャーを提供する。
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 定数
+DEFAULT_WORKERS = 4  # 同時に処理するバッチ数
+DEFAULT_MAX_PER_HOST = 4  # ホストあたりの同時接続数の上限
+DEFAULT_RATE_LIMIT = 5.0  # 1秒あたりの最大リクエスト数（0以下で無制限）
+DEFAULT_TIMEOUT = (10, 120)  # (接続, 読み込み) のタイムアウト秒数
+DEFAULT_MAX_RETRIES = 4  # 一時的なエラーに対する最大リトライ回数
+BACKOFF_BASE = 1.0  # リトライ間隔の基準秒数（試行ごとに倍増）
+BACKOFF_MAX = 60.0  # リトライ間隔の上限秒数
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # リトライするHTTPステータス
+DEFAULT_MIN_BATCH_SIZE = 50  # 適応的バッチサイズの下限
+DEFAULT_TARGET_LATENCY = 15.0  # 1リクエストあたりの目標応答時間（秒）
+MAX_ERROR_MESSAGE_LENGTH = 200  # ログに出力するエラーメッセージの最大長（URLが長くなるため）
+
+
+class RateLimiter:
+    """
+    リクエストの開始間隔を一定以上に保つスレッドセーフなレートリミッター
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    指数バックオフの待機秒数をフルジッター付きで計算
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def retry_after_delay(response: requests.Response) -> float:
+    """
+    Retry-Afterヘッダー（秒数またはHTTP日付）から待機秒数を求める
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return min(BACKOFF_MAX, max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return min(BACKOFF_MAX, max(0.0, retry_at.timestamp() - time.time()))
+
+
+class PoliteSession(requests.Session):
+    """
+    接続プールを共有し、ホストごとの同時接続数とリクエストレートを制限するセッション
+    タイムアウトを必ず設定し、一時的なエラーはバックオフしながらリトライする
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_WORKERS,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 rate_limit: float = DEFAULT_RATE_LIMIT,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        super().__init__()
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, max_per_host))
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.max_per_host = max(1, max_per_host)
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.host_semaphores: Dict[str, threading.Semaphore] = {}
+        self.host_lock = threading.Lock()
+
+    def host_semaphore(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self.host_lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.Semaphore(self.max_per_host)
+            return self.host_semaphores[host]
+
+    def request(self, method, url, *args, max_retries: Optional[int] = None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                with self.host_semaphore(url):
+                    self.rate_limiter.wait()
+                    response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"通信エラーのため{delay:.1f}秒後にリトライします ({attempt + 1}/{max_retries}): {type(e).__name__}")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                    return response
+                delay = max(retry_after_delay(response), backoff_delay(attempt))
+                print(f"HTTP {response.status_code} のため{delay:.1f}秒後にリトライします ({attempt + 1}/{max_retries})")
+                response.close()
+            # 待機中はホストの接続枠を解放しておく
+            time.sleep(delay)
+            attempt += 1
+
+
+class AdaptiveBatchSizer:
+    """
+    応答時間とエラーに応じて1リクエストあたりのISBN数を調整する（加算増加・乗算減少）
+    """
+
+    def __init__(self, max_size: int, min_size: int = DEFAULT_MIN_BATCH_SIZE,
+                 target_latency: float = DEFAULT_TARGET_LATENCY):
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.target_latency = target_latency
+        self.step = max(1, max_size // 10)
+        self.size = max_size
+        self.lock = threading.Lock()
+
+    def record_success(self, latency: float):
+        with self.lock:
+            if latency > self.target_latency * 2:
+                self.size = max(self.min_size, self.size // 2)
+            elif latency < self.target_latency:
+                self.size = min(self.max_size, self.size + self.step)
+
+    def record_failure(self):
+        with self.lock:
+            self.size = max(self.min_size, self.size // 2)
+
+    def current(self) -> int:
+        with self.lock:
+            return self.size
+
+
+def describe_error(error: Exception) -> str:
+    """
+    ログ出力用にエラーを短く整形する（HTTPエラーはISBNを列挙したURLを含むため省略）
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"HTTP {error.response.status_code} {error.response.reason}"
+    message = str(error)
+    if len(message) > MAX_ERROR_MESSAGE_LENGTH:
+        message = message[:MAX_ERROR_MESSAGE_LENGTH] + "..."
+    return message
+
+
+def create_session(workers: int = DEFAULT_WORKERS,
+                   max_per_host: int = DEFAULT_MAX_PER_HOST,
+                   rate_limit: float = DEFAULT_RATE_LIMIT,
+                   max_retries: int = DEFAULT_MAX_RETRIES) -> PoliteSession:
+    """
+    並行数に合わせた接続プールを持つセッションを作成
+    """
+    return PoliteSession(pool_size=workers, max_per_host=max_per_host,
+                         rate_limit=rate_limit, max_retries=max_retries)
+
+
+def fetch_in_order(fetch: Callable[[Any], Any],
+                   batches: Iterable[Any],
+                   workers: int = DEFAULT_WORKERS
+                   ) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    バッチを最大workers件並行して取得し、投入した順に
+    (バッチ, 取得結果, 例外) のタプルを返す
+
+    先読みするバッチ数はworkersの2倍までに抑え、メモリ使用量を一定に保つ
+    """
+    workers = max(1, workers)
+    window = workers * 2
+    batch_iter = iter(batches)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit_next() -> bool:
+            batch = next(batch_iter, None)
+            if batch is None:
+                return False
+            pending.append((batch, executor.submit(fetch, batch)))
+            return True
+
+        while len(pending) < window and submit_next():
+            pass
+
+        while pending:
+            batch, future = pending.popleft()
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            submit_next()
+            yield batch, result, error
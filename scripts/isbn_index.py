@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+分類済みISBNのコンパクトなインデックスを扱うモジュール
+
+ISBN-13を数値化して昇順の uint64 配列（array('Q')）として保持し、
+差分エンコード + zlib圧縮したバイナリファイルとして保存する。
+
+ファイルは追加・削除の差分を表すセグメントの列で、中間保存や差分更新では変更分のセグメントを
+末尾に追記するだけで済む（書き込み量は変更分に比例し、gitでも前回のファイルとの差分として保存される）。
+セグメントが MAX_SEGMENTS 個を超えたら、全体を1つのセグメントに書き直す（コンパクション）。
+"""
+import operator
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, compress
+from typing import Iterable, List, Optional, Tuple
+
+import data_paths
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+SEEN_ISBNS_FILE = os.path.join(DATA_DIR, "seen_isbns.bin")
+COVERAGE_SNAPSHOT_FILE = os.path.join(DATA_DIR, "coverage_snapshot.bin")
+INDEX_MAGIC = b"ISBNIDX1"  # 旧形式（全体を1つの圧縮データとして保存）
+SEGMENTED_MAGIC = b"ISBNSEG1"  # セグメント形式
+SEGMENT_HEADER = struct.Struct("<cI")  # 種類（+: 追加、-: 削除）と圧縮データの長さ
+SEGMENT_ADD = b"+"
+SEGMENT_REMOVE = b"-"
+COMPRESSION_LEVEL = 6  # 9は圧縮率がほぼ変わらず数倍遅い
+MAX_SEGMENTS = 32  # これを超えたらコンパクションする
+
+
+def isbn_to_int(isbn: str) -> Optional[int]:
+    """
+    ISBN-13文字列を数値に変換する（ハイフンは無視）
+    13桁の数字でない場合はNoneを返す
+    """
+    digits = isbn.replace("-", "").strip()
+    if len(digits) != 13 or not digits.isdigit():
+        return None
+    return int(digits)
+
+
+def int_to_isbn(value: int) -> str:
+    """
+    数値化したISBNを13桁の文字列に戻す
+    """
+    return f"{value:013d}"
+
+
+def encode_values(values: array) -> bytes:
+    """
+    昇順の uint64 配列を差分エンコードしてzlib圧縮する
+    """
+    deltas = array("Q", values[:1])
+    deltas.extend(map(operator.sub, values[1:], values[:-1]))
+    if sys.byteorder != "little":
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes(), COMPRESSION_LEVEL)
+
+
+def decode_values(data: bytes) -> array:
+    """
+    encode_values で圧縮したデータから昇順の uint64 配列を復元する
+    """
+    deltas = array("Q")
+    deltas.frombytes(zlib.decompress(data))
+    if sys.byteorder != "little":
+        deltas.byteswap()
+    return array("Q", accumulate(deltas))
+
+
+def read_segments(path: str) -> Tuple[List[Tuple[bytes, bytes]], int]:
+    """
+    セグメント形式のファイルから (種類, 圧縮データ) の列と、完全に書き込まれた範囲の終端を返す
+    書き込み途中で中断された末尾のセグメントは無視する
+    """
+    segments = []
+    with open(path, "rb") as f:
+        f.seek(len(SEGMENTED_MAGIC))
+        end = f.tell()
+        while True:
+            header = f.read(SEGMENT_HEADER.size)
+            if len(header) < SEGMENT_HEADER.size:
+                break
+            kind, length = SEGMENT_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length or kind not in (SEGMENT_ADD, SEGMENT_REMOVE):
+                break
+            segments.append((kind, data))
+            end = f.tell()
+    return segments, end
+
+
+def load_index(path: str) -> array:
+    """
+    インデックスファイルを読み込み、昇順の uint64 配列を返す
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return array("Q")
+
+    with open(path, "rb") as f:
+        magic = f.read(len(SEGMENTED_MAGIC))
+    if magic == INDEX_MAGIC:
+        with open(path, "rb") as f:
+            return decode_values(f.read()[len(INDEX_MAGIC):])
+    if magic != SEGMENTED_MAGIC:
+        raise ValueError(f"インデックスファイルの形式が不正です: {path}")
+
+    segments, _ = read_segments(path)
+    if not segments:
+        return array("Q")
+    # 先頭のセグメント（コンパクション済みの全体）以降の変更は、値ごとに最後の操作だけを反映する
+    values = decode_values(segments[0][1]) if segments[0][0] == SEGMENT_ADD else array("Q")
+    latest = {}
+    for kind, data in segments[1:]:
+        is_add = kind == SEGMENT_ADD
+        for value in decode_values(data):
+            latest[value] = is_add
+    values = merge(values, (value for value, is_add in latest.items() if is_add))
+    return subtract(values, array("Q", sorted(value for value, is_add in latest.items() if not is_add)))
+
+
+def save_index(path: str, values: array):
+    """
+    昇順の uint64 配列を1つのセグメントとして書き直す（コンパクション）
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = encode_values(values)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SEGMENTED_MAGIC)
+        f.write(SEGMENT_HEADER.pack(SEGMENT_ADD, len(data)))
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def append_index(path: str, added: Iterable[int] = (), removed: Iterable[int] = ()) -> int:
+    """
+    追加・削除されたISBNをセグメントとしてファイルの末尾に追記し、追記後のセグメント数を返す
+    旧形式のファイルは先にセグメント形式に変換する
+    """
+    added = array("Q", sorted(set(added)))
+    removed = array("Q", sorted(set(removed)))
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        save_index(path, array("Q"))
+    else:
+        with open(path, "rb") as f:
+            is_legacy = f.read(len(INDEX_MAGIC)) == INDEX_MAGIC
+        if is_legacy:
+            save_index(path, load_index(path))
+
+    segments, end = read_segments(path)
+    with open(path, "r+b") as f:
+        # 中断されて途中まで書き込まれたセグメントがあれば切り捨ててから追記する
+        f.truncate(end)
+        f.seek(end)
+        for kind, values in ((SEGMENT_REMOVE, removed), (SEGMENT_ADD, added)):
+            if values:
+                data = encode_values(values)
+                f.write(SEGMENT_HEADER.pack(kind, len(data)))
+                f.write(data)
+                segments.append((kind, data))
+        f.flush()
+        os.fsync(f.fileno())
+    return len(segments)
+
+
+def contains(values: array, value: int) -> bool:
+    """
+    昇順配列に値が含まれるかを二分探索で判定
+    """
+    pos = bisect_left(values, value)
+    return pos < len(values) and values[pos] == value
+
+
+def merge(values: array, new_values: Iterable[int]) -> array:
+    """
+    昇順配列に新しい値をマージし、重複のない昇順配列を返す
+    追加分の挿入位置を二分探索し、その間の区間はまとめてコピーする
+    """
+    additions = sorted(set(new_values))
+    if not additions:
+        return values
+
+    merged = array("Q")
+    start, n = 0, len(values)
+    for value in additions:
+        pos = bisect_left(values, value, start)
+        merged.extend(values[start:pos])
+        start = pos
+        if pos == n or values[pos] != value:
+            merged.append(value)
+    merged.extend(values[start:])
+    return merged
+
+
+def subtract(values: array, removals: array) -> array:
+    """
+    昇順配列から、昇順配列removalsに含まれる値を取り除く
+    """
+    if not removals:
+        return values
+
+    result = array("Q")
+    start, n = 0, len(values)
+    for value in removals:
+        pos = bisect_left(values, value, start)
+        result.extend(values[start:pos])
+        start = pos + 1 if pos < n and values[pos] == value else pos
+    result.extend(values[start:])
+    return result
+
+
+def diff_snapshot(snapshot: array, values: Iterable[int]) -> Tuple[array, array]:
+    """
+    前回のスナップショット（昇順）と今回のISBNリストを比較し、
+    (追加されたISBN（今回の順序のまま）, 削除されたISBN（昇順）) を返す
+
+    今回のリストは並べ替えずに二分探索で照合し、スナップショット側は
+    出現フラグのバイト列で削除分を求めるため、追加のメモリはわずかで済む
+    """
+    present = bytearray(len(snapshot))
+    added = array("Q")
+    n = len(snapshot)
+    for value in values:
+        pos = bisect_left(snapshot, value)
+        if pos < n and snapshot[pos] == value:
+            present[pos] = 1
+        else:
+            added.append(value)
+    missing = present.translate(bytes([1]) + bytes(255))
+    removed = array("Q", compress(snapshot, missing))
+    return added, removed
+
+
+def load_coverage_snapshot(data_dir: Optional[str] = None) -> array:
+    """
+    前回実行時のカバレッジのスナップショットを読み込む
+    """
+    return load_index(data_paths.resolve(COVERAGE_SNAPSHOT_FILE, data_dir))
+
+
+def save_coverage_snapshot(values: array, data_dir: Optional[str] = None):
+    """
+    カバレッジのスナップショットを書き直す
+    """
+    save_index(data_paths.resolve(COVERAGE_SNAPSHOT_FILE, data_dir), values)
+
+
+def update_coverage_snapshot(values: array, added: Iterable[int], removed: Iterable[int],
+                             data_dir: Optional[str] = None):
+    """
+    スナップショットへの追加・削除を追記する（valuesは反映後の全体で、セグメントが多すぎる場合に書き直す）
+    """
+    if append_index(data_paths.resolve(COVERAGE_SNAPSHOT_FILE, data_dir), added, removed) > MAX_SEGMENTS:
+        save_coverage_snapshot(values, data_dir)
+
+
+def load_seen_isbns(data_dir: Optional[str] = None) -> array:
+    """
+    分類済みISBN（新書かどうかに関わらず）のインデックスを読み込む
+    """
+    return load_index(data_paths.resolve(SEEN_ISBNS_FILE, data_dir))
+
+
+def save_seen_isbns(values: array, data_dir: Optional[str] = None):
+    """
+    分類済みISBNのインデックスを書き直す
+    """
+    save_index(data_paths.resolve(SEEN_ISBNS_FILE, data_dir), values)
+
+
+def add_seen_isbns(values: Iterable[int], data_dir: Optional[str] = None) -> int:
+    """
+    新たに分類したISBNをインデックスに追記し、追記後のセグメント数を返す
+    """
+    return append_index(data_paths.resolve(SEEN_ISBNS_FILE, data_dir), added=values)
+
+
+def filter_unseen(values: Iterable[int], seen: array) -> array:
+    """
+    インデックスに含まれない数値化ISBNのみを元の順序のまま返す
+    """
+    return array("Q", (value for value in values if not contains(seen, value)))
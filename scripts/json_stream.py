@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+JSON配列を要素ごとに逐次デコードするモジュール
+
+レスポンス全体をPythonオブジェクトに変換せず、受信したチャンクから
+配列の要素を1つずつ取り出すことで、ピークメモリを要素1つ分に抑える。
+"""
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+# 定数
+WHITESPACE = " \t\n\r"
+DELIMITERS = WHITESPACE + ",]"
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    UTF-8のバイト列チャンクからトップレベルのJSON配列の要素を順に返す
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    finished = False
+
+    def drain(final: bool) -> Iterator[Any]:
+        nonlocal buffer, started, finished
+        pos = 0
+        length = len(buffer)
+        while not finished:
+            while pos < length and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos >= length:
+                break
+            char = buffer[pos]
+            if not started:
+                if char != "[":
+                    raise ValueError("JSON配列ではありません")
+                started = True
+                pos += 1
+                continue
+            if char == ",":
+                pos += 1
+                continue
+            if char == "]":
+                finished = True
+                pos += 1
+                break
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                # 要素の途中でチャンクが切れているため、続きを受信してから再試行する
+                break
+            if not final and (end >= length or buffer[end] not in DELIMITERS):
+                # 数値などは続きのチャンクで桁が増える可能性があるため、
+                # 区切り文字を受信するまで確定させない
+                break
+            yield value
+            pos = end
+        buffer = buffer[pos:]
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        yield from drain(final=False)
+        if finished:
+            return
+    buffer += utf8.decode(b"", final=True)
+    yield from drain(final=True)
+    if not finished:
+        raise ValueError("JSON配列が途中で終了しています")
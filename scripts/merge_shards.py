@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+fetch_shinsho.py --shard i/N で分割実行した全件スキャンの出力を統合するスクリプト
+
+全シャードのスキャンが完了している場合のみ、レコードストア・新規レコード・
+分類済みインデックス・カバレッジのスナップショット・出版者記号ごとの統計を
+1プロセスで全件スキャンした場合と同じ形で data/ に書き出し、シャードのディレクトリを削除する。
+レコードストアを全件置き換えるため、query_records.py 用の二次インデックスは作り直し、
+検索インデックスは次回のフィード生成でレコードストアから作り直されるよう削除する。
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+from array import array
+from datetime import datetime
+from typing import Dict, List
+
+import data_paths
+import fetch_shinsho
+import isbn_index
+import prefix_stats
+import record_index
+import record_store
+import run_metrics
+import scan_state
+import search_index
+import shard
+
+# 定数
+EXIT_INCOMPLETE = 2  # 未完了のシャードがある場合の終了コード
+
+
+def load_json(path: str, default):
+    """
+    JSONファイルを読み込む（存在しなければdefaultを返す）
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def incomplete_shards(count: int) -> List[int]:
+    """
+    スキャンが完了していないシャードの番号を返す
+    """
+    incomplete = []
+    for index in range(count):
+        state = scan_state.load_scan_state(shard.shard_dir(index, count))
+        if not state or state.get("status") != scan_state.STATUS_COMPLETED:
+            incomplete.append(index)
+    return incomplete
+
+
+def merge_shards(count: int):
+    """
+    全シャードの出力を統合して data/ に保存
+    """
+    records: Dict[str, Dict] = {}
+    new_records: List[Dict] = []
+    seen_isbns = array("Q")
+    coverage_snapshot = array("Q")
+    stats: Dict[str, List[int]] = {}
+    shard_reports: List[Dict] = []
+
+    for index in range(count):
+        directory = shard.shard_dir(index, count)
+        shard_records = record_store.load_records(directory)
+        records.update(shard_records)
+        new_file = load_json(data_paths.resolve(fetch_shinsho.NEW_RECORDS_FILE, directory), {})
+        new_records.extend(new_file.get("records", []))
+        seen_isbns = isbn_index.merge(seen_isbns, isbn_index.load_seen_isbns(directory))
+        coverage_snapshot = isbn_index.merge(coverage_snapshot, isbn_index.load_coverage_snapshot(directory))
+        prefix_stats.merge_stats(stats, prefix_stats.load_prefix_stats(directory) or {})
+        print(f"シャード {index}/{count}: 新書 {len(shard_records)}件")
+
+        # シャードの実行レポートは履歴に引き継ぐ
+        report = load_json(data_paths.resolve(run_metrics.RUN_REPORT_FILE, directory), None)
+        if report:
+            report["shard"] = f"{index}/{count}"
+            shard_reports.append(report)
+    run_metrics.append_history(shard_reports)
+
+    # 1プロセスの全件スキャンと同様に、既存のレコードストアは全件置き換える
+    record_store.compact(records)
+    if os.path.exists(record_store.LEGACY_RECORDS_FILE):
+        os.remove(record_store.LEGACY_RECORDS_FILE)
+    # カバレッジの並び順はシャードごとに異なりうるため、新規レコードはISBN順に並べる
+    new_records.sort(key=lambda record: record["isbn"])
+    fetch_shinsho.save_new_records(new_records)
+    isbn_index.save_seen_isbns(seen_isbns)
+    isbn_index.save_coverage_snapshot(coverage_snapshot)
+    prefix_stats.save_prefix_stats(stats)
+
+    # 統合済みの全件スキャンとして記録し、差分更新の --resume で再開されないようにする
+    state = scan_state.new_scan_state(scan_state.compute_snapshot_id(coverage_snapshot), 0,
+                                      fetch_shinsho.BATCH_SIZE, {"shards": count})
+    state["status"] = scan_state.STATUS_COMPLETED
+    scan_state.save_scan_state(state)
+
+    # 置き換える前のレコードストアから作った索引は、統合したレコードと対応しない
+    record_index.update_if_present()
+    search_index.reset_search_index()
+
+    print(f"\n統合完了 ({datetime.now().isoformat()}):")
+    print(f"- 新書総数: {len(records)}")
+    print(f"- 分類済みISBN総数: {len(seen_isbns)}")
+    print(f"- カバレッジのISBN数: {len(coverage_snapshot)}")
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = argparse.ArgumentParser(description='シャードに分割した全件スキャンの出力を統合するスクリプト')
+    parser.add_argument('--shards', type=int, required=True, help='シャード数（fetch_shinsho.py --shard i/N のN）')
+    parser.add_argument('--keep', action='store_true', help='統合後もシャードのディレクトリを残す')
+    args = parser.parse_args()
+
+    incomplete = incomplete_shards(args.shards)
+    if incomplete:
+        print(f"スキャンが完了していないシャードがあります: {incomplete}")
+        print("--resume 付きで該当シャードを再実行してから統合してください。")
+        sys.exit(EXIT_INCOMPLETE)
+
+    merge_shards(args.shards)
+    if not args.keep:
+        for index in range(args.shards):
+            shutil.rmtree(shard.shard_dir(index, args.shards), ignore_errors=True)
+        if os.path.isdir(shard.SHARDS_DIR) and not os.listdir(shard.SHARDS_DIR):
+            os.rmdir(shard.SHARDS_DIR)
+        print("シャードのディレクトリを削除しました")
+
+
+if __name__ == "__main__":
+    main()
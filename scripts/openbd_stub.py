@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+openBD API（/v1/coverage と /v1/get）を模したローカルHTTPサーバー
+
+合成したONIXデータ、またはverify_classifier.pyで記録したレスポンスを配信する。
+応答の遅延・エラー率・カタログの件数を指定でき、ベンチマークや動作確認を
+実際のAPIにアクセスせずに行える。
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# 定数
+DEFAULT_PORT = 8765
+DEFAULT_SIZE = 20000  # 合成するカタログのISBN数
+DEFAULT_SHINSHO_RATIO = 0.05  # 合成データのうち新書の割合
+DEFAULT_JP_RATIO = 0.8  # 合成データのうち日本の書籍（978-4）の割合
+SHINSHO_LABELS = ["岩波新書", "中公新書", "講談社現代新書", "ちくま新書", "光文社新書"]
+OTHER_LABELS = ["岩波文庫", "新潮文庫", "講談社学術文庫", None]
+PUBLISHERS = ["岩波書店", "中央公論新社", "講談社", "筑摩書房", "光文社", "新潮社"]
+
+
+def isbn13(body: str) -> str:
+    """
+    12桁の本体にチェックディジットを付けてISBN-13にする
+    """
+    total = sum(int(ch) * (1 if i % 2 == 0 else 3) for i, ch in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def synthetic_book(isbn: str, index: int, is_shinsho: bool) -> Dict:
+    """
+    実際のopenBDのレスポンスに近い構造と大きさの書籍データを合成する
+    """
+    rng = random.Random(index)
+    publisher = PUBLISHERS[index % len(PUBLISHERS)]
+    label = SHINSHO_LABELS[index % len(SHINSHO_LABELS)] if is_shinsho else OTHER_LABELS[index % len(OTHER_LABELS)]
+    date = f"20{rng.randint(10, 26):02d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+    descriptive_detail = {
+        "ProductComposition": "00",
+        "ProductForm": "BA",
+        "Measure": [{"MeasureType": "01", "Measurement": "173", "MeasureUnitCode": "mm"}],
+        "TitleDetail": {
+            "TitleType": "01",
+            "TitleElement": {
+                "TitleElementLevel": "01",
+                "TitleText": {"collationkey": f"ショメイ{index}", "content": f"書名{index}"},
+                "Subtitle": {"collationkey": "サブタイトル", "content": f"副題{index % 97}"}
+            }
+        },
+        "Contributor": [
+            {
+                "SequenceNumber": str(n + 1),
+                "ContributorRole": "A01" if n == 0 else "B06",
+                "PersonName": {"collationkey": f"チョシャ{index % 500}", "content": f"著者{(index + n) % 500}"},
+                "BiographicalNote": "1970年生まれ。専門は日本近代史。" * rng.randint(1, 4)
+            }
+            for n in range(rng.randint(1, 3))
+        ],
+        "Language": [{"LanguageRole": "01", "LanguageCode": "jpn", "CountryCode": "JP"}],
+        "Extent": [{"ExtentType": "11", "ExtentValue": str(rng.randint(150, 400)), "ExtentUnit": "03"}],
+        "Subject": [{"SubjectSchemeIdentifier": "78", "SubjectCode": "0021"}]
+    }
+    if label:
+        descriptive_detail["Collection"] = {
+            "CollectionType": "10",
+            "CollectionSequence": {"CollectionSequenceType": "02", "CollectionSequenceNumber": str(index % 3000)},
+            "TitleDetail": {
+                "TitleType": "01",
+                "TitleElement": {"TitleElementLevel": "02", "TitleText": {"collationkey": "レーベル", "content": label}}
+            }
+        }
+    return {
+        "onix": {
+            "RecordReference": isbn,
+            "NotificationType": "03",
+            "ProductIdentifier": {"ProductIDType": "15", "IDValue": isbn},
+            "DescriptiveDetail": descriptive_detail,
+            "CollateralDetail": {
+                "TextContent": [
+                    {"TextType": "02", "ContentAudience": "00", "Text": "内容紹介の短い文章です。" * rng.randint(2, 6)},
+                    {"TextType": "03", "ContentAudience": "00", "Text": "詳しい内容紹介の文章です。" * rng.randint(10, 40)}
+                ]
+            },
+            "PublishingDetail": {
+                "Imprint": {"ImprintIdentifier": [{"ImprintIDType": "19", "IDValue": "4000"}], "ImprintName": publisher},
+                "Publisher": {"PublishingRole": "01", "PublisherIdentifier": [{"PublisherIDType": "19", "IDValue": "4000"}],
+                              "PublisherName": publisher},
+                "PublishingDate": {"PublishingDateRole": "01", "Date": date}
+            },
+            "ProductSupply": {"SupplyDetail": {"ProductAvailability": "99",
+                                               "Price": [{"PriceType": "03", "PriceAmount": str(rng.randint(7, 12) * 100),
+                                                          "CurrencyCode": "JPY"}]}}
+        },
+        "hanmoto": {"datecreated": "2020-01-01 00:00:00", "dateshuppan": date[:4] + "-" + date[4:6]},
+        "summary": {"isbn": isbn, "title": f"書名{index}", "volume": "", "series": label or "",
+                    "publisher": publisher, "pubdate": date, "cover": "", "author": f"著者{index % 500}"}
+    }
+
+
+def synthetic_catalogue(size: int, shinsho_ratio: float = DEFAULT_SHINSHO_RATIO,
+                        jp_ratio: float = DEFAULT_JP_RATIO) -> Dict[str, bytes]:
+    """
+    合成したカタログを ISBN → エンコード済みの書籍JSON の辞書として返す（カバレッジ順）
+    """
+    rng = random.Random(size)
+    catalogue = {}
+    for index in range(size):
+        group = "4" if rng.random() < jp_ratio else "1"
+        isbn = isbn13(f"978{group}{index:08d}")
+        book = synthetic_book(isbn, index, rng.random() < shinsho_ratio)
+        catalogue[isbn] = json.dumps(book, ensure_ascii=False).encode("utf-8")
+    return catalogue
+
+
+def fixture_catalogue(path: str) -> Dict[str, bytes]:
+    """
+    verify_classifier.pyで記録したレスポンス（JSONL）からカタログを作成
+    """
+    catalogue = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch = json.loads(line)
+            for isbn, book in zip(batch["isbns"], json.loads(batch["body"])):
+                catalogue[isbn] = json.dumps(book, ensure_ascii=False).encode("utf-8") if book else b"null"
+    return catalogue
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /v1/coverage と /v1/get に応答するハンドラー（設定はサーバーの属性から読む）
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path.endswith("/coverage"):
+            # 条件付きリクエストを確認できるよう、変更がなければ304で応答する
+            if self.headers.get("If-None-Match") == server.coverage_etag:
+                self.send_body(304, headers={"ETag": server.coverage_etag})
+                return
+            self.send_body(200, server.coverage_body, {"Content-Type": "application/json",
+                                                       "ETag": server.coverage_etag})
+            return
+        if not url.path.endswith("/get"):
+            self.send_body(404)
+            return
+
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.error_rate > 0 and server.rng.random() < server.error_rate:
+            self.send_body(503, headers={"Retry-After": "0"})
+            return
+        isbns = parse_qs(url.query).get("isbn", [""])[0].split(",")
+        body = b"[" + b",".join(server.catalogue.get(isbn, b"null") for isbn in isbns) + b"]"
+        self.send_body(200, body, {"Content-Type": "application/json"})
+
+
+def create_server(catalogue: Dict[str, bytes], port: int = DEFAULT_PORT,
+                  latency: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> ThreadingHTTPServer:
+    """
+    カタログを配信するサーバーを作成（port=0で空いているポートを使う）
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.catalogue = catalogue
+    server.coverage_body = json.dumps(list(catalogue)).encode("utf-8")
+    server.coverage_etag = '"' + hashlib.sha1(server.coverage_body).hexdigest() + '"'
+    server.latency = latency
+    server.error_rate = error_rate
+    server.rng = random.Random(seed)
+    return server
+
+
+def start_in_thread(server: ThreadingHTTPServer) -> Tuple[str, threading.Thread]:
+    """
+    サーバーをバックグラウンドスレッドで起動し、APIのベースURLを返す
+    """
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1", thread
+
+
+def serve_in_process(size: int, fixture: Optional[str], shinsho_ratio: float,
+                     latency: float, error_rate: float, ready_queue):
+    """
+    子プロセスで空いているポートにサーバーを起動し、ベースURLをready_queueに送る
+    （計測対象とGILを共有しないよう、ベンチマークからはこの関数を別プロセスで実行する）
+    """
+    catalogue = build_catalogue(size, fixture, shinsho_ratio)
+    server = create_server(catalogue, 0, latency, error_rate)
+    host, port = server.server_address[:2]
+    ready_queue.put((f"http://{host}:{port}/v1", len(catalogue)))
+    server.serve_forever()
+
+
+def build_catalogue(size: int, fixture: Optional[str], shinsho_ratio: float) -> Dict[str, bytes]:
+    """
+    記録済みのレスポンスがあればそれを、なければ合成したカタログを返す
+    """
+    if fixture:
+        return fixture_catalogue(fixture)
+    return synthetic_catalogue(size, shinsho_ratio)
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = argparse.ArgumentParser(description='openBD APIを模したローカルサーバー')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='待ち受けるポート番号')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='合成するカタログのISBN数')
+    parser.add_argument('--shinsho-ratio', type=float, default=DEFAULT_SHINSHO_RATIO, help='合成データのうち新書の割合')
+    parser.add_argument('--fixture', default=None, help='記録済みのレスポンス（verify_classifier.py --record で作成）')
+    parser.add_argument('--latency', type=float, default=0.0, help='/get の応答を遅らせる秒数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='/get が503を返す確率')
+    args = parser.parse_args()
+
+    catalogue = build_catalogue(args.size, args.fixture, args.shinsho_ratio)
+    server = create_server(catalogue, args.port, args.latency, args.error_rate)
+    print(f"openBDスタブを起動しました: http://127.0.0.1:{args.port}/v1 (ISBN数: {len(catalogue)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
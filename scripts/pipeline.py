@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+新書データの取得とRSSフィードの生成を1プロセスで実行するスクリプト
+
+fetch_shinsho.py と generate_rss.py を続けて実行するのと同じ結果になるが、
+取得した新規レコードは新規レコードファイルを読み直さずにメモリ上のまま渡し、
+インタープリターの起動やモジュールの読み込みも1回で済ませる。
+新規レコードファイルやフィード履歴などの中間ファイルは従来どおり保存する。
+"""
+import argparse
+import time
+
+import feed_order
+import fetch_shinsho
+import generate_rss
+import run_metrics
+
+
+def run_pipeline(args: argparse.Namespace):
+    """
+    取得処理を実行し、その結果からフィードを生成する
+    """
+    fetch_start = time.perf_counter()
+    new_records_data = fetch_shinsho.run(args)
+    fetch_seconds = time.perf_counter() - fetch_start
+    if new_records_data is None:
+        print("取得処理で新規レコードが作成されなかったため、フィードは生成しません")
+        return
+
+    print("\nRSSフィード生成を開始します...")
+    feed_start = time.perf_counter()
+    generate_rss.generate_feed(args.order, new_records_data)
+    feed_seconds = time.perf_counter() - feed_start
+    print(f"パイプライン完了（取得: {fetch_seconds:.1f}秒、フィード生成: {feed_seconds:.1f}秒）")
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = fetch_shinsho.build_arg_parser('新書データの取得とRSSフィードの生成を1プロセスで実行するスクリプト')
+    parser.add_argument('--order', choices=feed_order.ORDER_POLICIES, default=feed_order.DEFAULT_ORDER_POLICY,
+                        help='フィードの並び順（fetched: 取得した順、published: 出版日の新しい順）')
+    args = parser.parse_args()
+    if args.shard:
+        parser.error("--shard は分割実行用のため pipeline.py では使えません（merge_shards.py の後に generate_rss.py を実行してください）")
+
+    if args.profile:
+        run_metrics.run_profiled(run_pipeline, args)
+    else:
+        run_pipeline(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+ISBNの出版者記号（プレフィックス）ごとの新書の割合を管理するモジュール
+
+分類したISBNの件数と、そのうち新書だった件数を出版者記号ごとに data/prefix_stats.json に保存する。
+新書の割合（新書率）の高い出版者記号のISBNから順に処理することで、制限時間で中断される
+スキャンでも新書を先に見つけられる。十分な件数を分類して新書率が低いと分かった出版者記号は、
+--jp-only と同様に処理対象から外すこともできる。
+日本（978-4）の出版者記号は桁数が先頭の数字で決まるため、その範囲に従って切り出す。
+それ以外のISBNは接頭部と国記号の先頭1桁（978-0 など）でまとめる。
+"""
+import json
+import os
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import data_paths
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+PREFIX_STATS_FILE = os.path.join(DATA_DIR, "prefix_stats.json")
+JAPAN_PREFIX = 9784  # 978-4（日本）
+# 日本の出版者記号の桁数ごとの上限（先頭からその桁数を取った値がこれ未満ならその桁数。どれにも当たらなければ7桁）
+JAPAN_REGISTRANT_RANGES = ((2, 20), (3, 700), (4, 8500), (5, 90000), (6, 950000))
+PRIOR_WEIGHT = 20  # 未知・件数の少ない出版者記号の新書率を全体の新書率に寄せる強さ（分類件数換算）
+PRUNE_MIN_SAMPLES = 1000  # 絞り込みの対象にするのに必要な分類件数
+
+
+def registrant_prefix(value: int) -> str:
+    """
+    数値化したISBN-13の出版者記号までのプレフィックスを返す（例: 978-4-06）
+    """
+    if value // 1000000000 != JAPAN_PREFIX:
+        head = str(value // 1000000000)
+        return f"{head[:3]}-{head[3:]}"
+    rest = value % 1000000000  # 出版者記号・書名記号（計8桁）とチェックディジット
+    for digits, limit in JAPAN_REGISTRANT_RANGES:
+        code = rest // 10 ** (9 - digits)
+        if code < limit:
+            return f"978-4-{code:0{digits}d}"
+    return f"978-4-{rest // 100:07d}"
+
+
+def load_prefix_stats(data_dir: Optional[str] = None) -> Optional[Dict[str, List[int]]]:
+    """
+    出版者記号ごとの [分類件数, 新書件数] を読み込む（ファイルがなければNone）
+    """
+    path = data_paths.resolve(PREFIX_STATS_FILE, data_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("prefixes", {})
+
+
+def save_prefix_stats(stats: Dict[str, List[int]], data_dir: Optional[str] = None):
+    """
+    出版者記号ごとの [分類件数, 新書件数] を保存
+    """
+    path = data_paths.resolve(PREFIX_STATS_FILE, data_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"prefixes": dict(sorted(stats.items()))}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def add_counts(stats: Dict[str, List[int]], classified: Iterable[int], shinsho: Iterable[int]):
+    """
+    分類したISBNと、そのうち新書だったISBNを統計に加える
+    """
+    for value in classified:
+        stats.setdefault(registrant_prefix(value), [0, 0])[0] += 1
+    for value in shinsho:
+        stats.setdefault(registrant_prefix(value), [0, 0])[1] += 1
+
+
+def merge_stats(stats: Dict[str, List[int]], other: Dict[str, List[int]]):
+    """
+    別の統計（シャードの統計など）の件数を加える
+    """
+    for prefix, (classified, shinsho) in other.items():
+        counts = stats.setdefault(prefix, [0, 0])
+        counts[0] += classified
+        counts[1] += shinsho
+
+
+def build_prefix_stats(classified: Iterable[int], shinsho: Iterable[int]) -> Dict[str, List[int]]:
+    """
+    分類済みインデックスと新書レコードのISBNから統計を作り直す（統計ファイルがない場合用）
+    """
+    stats: Dict[str, List[int]] = {}
+    add_counts(stats, classified, shinsho)
+    return stats
+
+
+def prefix_scores(stats: Dict[str, List[int]]) -> Tuple[Dict[str, float], float]:
+    """
+    出版者記号ごとの推定新書率と、統計のない出版者記号に使う全体の新書率を返す
+    分類件数の少ない出版者記号は全体の新書率に寄せて推定する
+    """
+    total_classified = sum(counts[0] for counts in stats.values())
+    total_shinsho = sum(counts[1] for counts in stats.values())
+    default = total_shinsho / total_classified if total_classified else 0.0
+    scores = {prefix: (shinsho + PRIOR_WEIGHT * default) / (classified + PRIOR_WEIGHT)
+              for prefix, (classified, shinsho) in stats.items()}
+    return scores, default
+
+
+def prioritize(values: array, stats: Dict[str, List[int]]) -> array:
+    """
+    ISBNを推定新書率の高い出版者記号の順に並べ替える
+    同じ出版者記号の中（と推定新書率が同じ出版者記号の間）では元の順序を保つ
+    """
+    if not stats:
+        return values
+    buckets: Dict[str, array] = {}
+    for value in values:
+        prefix = registrant_prefix(value)
+        bucket = buckets.get(prefix)
+        if bucket is None:
+            bucket = buckets[prefix] = array("Q")
+        bucket.append(value)
+    scores, default = prefix_scores(stats)
+    ordered = array("Q")
+    for prefix in sorted(buckets, key=lambda prefix: -scores.get(prefix, default)):
+        ordered.extend(buckets[prefix])
+    return ordered
+
+
+def low_yield_prefixes(stats: Dict[str, List[int]], min_yield: float,
+                       min_samples: int = PRUNE_MIN_SAMPLES) -> List[str]:
+    """
+    min_samples件以上分類し、新書率がmin_yield未満だった出版者記号を返す
+    """
+    return sorted(prefix for prefix, (classified, shinsho) in stats.items()
+                  if classified >= min_samples and shinsho < min_yield * classified)
+
+
+def prune(values: array, stats: Dict[str, List[int]], min_yield: float,
+          min_samples: int = PRUNE_MIN_SAMPLES) -> array:
+    """
+    新書率の低い出版者記号のISBNを除外する（--jp-only と同様の絞り込み）
+    """
+    excluded = set(low_yield_prefixes(stats, min_yield, min_samples))
+    if not excluded:
+        return values
+    kept = array("Q", (value for value in values if registrant_prefix(value) not in excluded))
+    print(f"新書率が{min_yield:.2%}未満の出版者記号 {len(excluded)}件のISBNを除外: {len(values) - len(kept)}件")
+    return kept
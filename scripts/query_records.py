@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+保存済みの新書レコードをシリーズ名・出版社・著者名・出版日で検索するスクリプト
+
+record_index.py の二次インデックスで該当するISBNを求め、レコードストアから該当する行だけを読み出す。
+インデックスは初回の実行時に作成し、以降はレコードストアに追記された分だけを反映する。
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import Dict, List, Set, Tuple
+
+import record_index
+import record_refresh
+
+# 定数
+OUTPUT_FORMATS = ("json", "csv")
+CSV_FIELDS = ("isbn", "title", "subtitle", "authors", "collection", "imprint", "publisher", "publishing_date", "fetched_at")
+
+
+def date_bound(value: str, fill: str) -> str:
+    """
+    YYYY / YYYYMM / YYYYMMDD（区切り文字は任意）の日付を、範囲の端として8桁に揃える
+    """
+    digits = "".join(ch for ch in value if ch.isdigit())[:8]
+    if len(digits) not in (4, 6, 8):
+        raise argparse.ArgumentTypeError(f"日付はYYYY、YYYYMM、YYYYMMDDのいずれかで指定してください: {value}")
+    return digits.ljust(8, fill)
+
+
+def find_isbns(args: argparse.Namespace) -> Tuple[Set[str], Dict]:
+    """
+    指定した条件をすべて満たすISBNを二次インデックスから求める
+    """
+    conditions = [(name, value) for name, value in (("collection", args.collection),
+                                                    ("publisher", args.publisher),
+                                                    ("author", args.author)) if value]
+    parts = ["offsets"] + [name for name, _ in conditions]
+    if args.since or args.until:
+        parts.append("date")
+    # インデックスの作成・更新の表示は出力（標準出力）に混ぜない
+    with redirect_stdout(sys.stderr):
+        index = record_index.refresh_index(parts, rebuild=args.rebuild)
+
+    candidates = [record_index.lookup(index, name, value) for name, value in conditions]
+    if args.since or args.until:
+        candidates.append(record_index.lookup_dates(index, args.since or "", args.until or ""))
+    candidates.sort(key=len)
+    isbns = candidates[0]
+    for other in candidates[1:]:
+        isbns = isbns & other
+    return isbns, index
+
+
+def sort_records(records: List[Dict]) -> List[Dict]:
+    """
+    出版日の新しい順（同じ出版日ならISBN順）に並べる
+    """
+    records.sort(key=lambda record: record.get("isbn", ""))
+    records.sort(key=lambda record: record_refresh.normalize_date(record.get("publishing_date", "")), reverse=True)
+    return records
+
+
+def write_csv(records: List[Dict], out):
+    """
+    レコードをCSVで出力する（著者名は「 / 」で連結）
+    """
+    writer = csv.writer(out)
+    writer.writerow(CSV_FIELDS)
+    for record in records:
+        authors = " / ".join(author.get("name", "") for author in record.get("authors") or [])
+        writer.writerow([authors if field == "authors" else record.get(field, "") for field in CSV_FIELDS])
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = argparse.ArgumentParser(description='保存済みの新書レコードを二次インデックスで検索するスクリプト')
+    parser.add_argument('--collection', help='シリーズ名（レーベル名）')
+    parser.add_argument('--publisher', help='出版社名（発行元・発売元のどちらでも一致）')
+    parser.add_argument('--author', help='著者名（空白・記号・全角半角の違いは無視）')
+    parser.add_argument('--since', type=lambda value: date_bound(value, "0"), help='出版日の範囲の開始（YYYY、YYYYMM、YYYYMMDD）')
+    parser.add_argument('--until', type=lambda value: date_bound(value, "9"), help='出版日の範囲の終了（YYYY、YYYYMM、YYYYMMDD）')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default="json", help='出力形式')
+    parser.add_argument('--limit', type=int, default=None, help='出力する最大件数')
+    parser.add_argument('--rebuild', action='store_true', help='二次インデックスを作り直してから検索する')
+    args = parser.parse_args()
+    if not (args.collection or args.publisher or args.author or args.since or args.until):
+        parser.error("--collection、--publisher、--author、--since、--until のいずれかを指定してください")
+
+    start = time.perf_counter()
+    isbns, index = find_isbns(args)
+    records = sort_records(record_index.read_records(index, isbns))
+    if args.limit is not None:
+        records = records[:args.limit]
+
+    if args.format == "csv":
+        write_csv(records, sys.stdout)
+    else:
+        json.dump(records, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    print(f"{len(isbns)}件が該当（{len(records)}件を出力、{time.perf_counter() - start:.2f}秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+レコードストア（shinsho_records.jsonl）の二次インデックスを管理するモジュール
+
+シリーズ名・出版社（発行元と発売元）・著者名の正規化した値ごとのISBNと、出版日順のISBNの一覧、
+各ISBNの最新の行のログ上の位置（バイトオフセット）を data/record_index/ に保存する。
+検索では必要なインデックスとオフセットだけを読み込み、該当する行だけをログから読み出す。
+レコードストアは追記型のため、前回索引したログの末尾から後ろに追記された行だけを読んで更新する。
+コンパクションなどでログが書き直された場合（ファイルが置き換えられたか、索引した範囲の末尾の内容が
+変わった場合）は作り直す。
+"""
+import hashlib
+import json
+import os
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import data_paths
+import record_refresh
+import record_store
+import search_index
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+RECORD_INDEX_DIR = os.path.join(DATA_DIR, "record_index")
+INDEX_VERSION = 1
+TAIL_BYTES = 4096  # ログが書き直されていないかを確かめる、索引済みの範囲の末尾のバイト数
+KEY_INDEXES = {
+    "collection": ("collection",),  # シリーズ（レーベル）
+    "publisher": ("imprint", "publisher")  # 発行元・発売元のどちらでも引ける
+}
+INDEX_PARTS = ("offsets", "date", "author") + tuple(KEY_INDEXES)
+
+
+def index_path(name: str, data_dir: Optional[str] = None) -> str:
+    """
+    インデックスの各部分の保存先を返す
+    """
+    return os.path.join(data_paths.resolve(RECORD_INDEX_DIR, data_dir), f"{name}.json")
+
+
+def normalize_key(value: str) -> str:
+    """
+    インデックスのキーを正規化する（検索インデックスと同じく空白や記号、全角・半角の違いを無視する）
+    """
+    return search_index.normalize(value or "")
+
+
+def record_keys(record: Dict) -> Dict[str, Set[str]]:
+    """
+    レコードを登録するキー（インデックスごとの正規化した値）を返す
+    """
+    keys = {name: {normalize_key(record.get(field)) for field in fields} - {""}
+            for name, fields in KEY_INDEXES.items()}
+    keys["author"] = {normalize_key(author.get("name")) for author in record.get("authors") or []} - {""}
+    return keys
+
+
+def tail_digest(path: str, size: int) -> str:
+    """
+    ログの先頭からsizeバイトまでのうち、末尾TAIL_BYTESバイトのハッシュを返す
+    """
+    with open(path, "rb") as f:
+        f.seek(max(0, size - TAIL_BYTES))
+        return hashlib.sha1(f.read(min(size, TAIL_BYTES))).hexdigest()
+
+
+def load_meta(data_dir: Optional[str] = None) -> Optional[Dict]:
+    """
+    インデックスの作成時のログのサイズなどを読み込む（インデックスがなければNone）
+    """
+    path = index_path("meta", data_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_parts(names: Iterable[str], data_dir: Optional[str] = None) -> Dict:
+    """
+    インデックスのうち指定した部分だけを読み込む
+    """
+    index = {}
+    for name in names:
+        with open(index_path(name, data_dir), "r", encoding="utf-8") as f:
+            index[name] = json.load(f)
+    return index
+
+
+def save_index(index: Dict, meta: Dict, data_dir: Optional[str] = None):
+    """
+    インデックスを保存する（途中で中断されても古いメタ情報で作り直されるよう、メタ情報は最後に書く）
+    """
+    os.makedirs(data_paths.resolve(RECORD_INDEX_DIR, data_dir), exist_ok=True)
+    for name in INDEX_PARTS + ("meta",):
+        path = index_path(name, data_dir)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta if name == "meta" else index[name], f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+
+
+def read_record_at(f, offset: int) -> Dict:
+    """
+    ログのoffsetの位置にある行のレコードを読み込む
+    """
+    f.seek(offset)
+    return json.loads(f.readline())
+
+
+def date_entry(record: Dict) -> Tuple[str, str]:
+    """
+    出版日のインデックスの要素（8桁に揃えた出版日, ISBN）を返す
+    """
+    return record_refresh.normalize_date(record.get("publishing_date", "")), record["isbn"]
+
+
+def merge_dates(index: Dict, added: List[Tuple[str, str]], removed: List[Tuple[str, str]]):
+    """
+    出版日のインデックスに追加・削除をまとめて反映し、出版日順に並べ直す
+    """
+    pending = Counter(removed)
+    entries = []
+    for entry in chain(zip(index["date"]["dates"], index["date"]["isbns"]), added):
+        if pending[entry] > 0:
+            pending[entry] -= 1
+            continue
+        entries.append(entry)
+    entries.sort()
+    index["date"] = {"dates": [date for date, _ in entries], "isbns": [isbn for _, isbn in entries]}
+
+
+def add_record(index: Dict, record: Dict, offset: int):
+    """
+    レコードをシリーズ名・出版社・著者名のインデックスとオフセットに登録する
+    """
+    isbn = record["isbn"]
+    index["offsets"][isbn] = offset
+    for name, keys in record_keys(record).items():
+        for key in keys:
+            index[name].setdefault(key, []).append(isbn)
+
+
+def remove_record(index: Dict, record: Dict):
+    """
+    以前の内容のレコードをシリーズ名・出版社・著者名のインデックスから取り除く
+    """
+    isbn = record["isbn"]
+    for name, keys in record_keys(record).items():
+        for key in keys:
+            isbns = index[name].get(key, [])
+            if isbn in isbns:
+                isbns.remove(isbn)
+            if not isbns:
+                index[name].pop(key, None)
+
+
+def index_log(index: Dict, path: str, start: int) -> int:
+    """
+    ログのstartバイト目以降の行をインデックスに反映し、反映した範囲の終端の位置を返す
+    書き込み途中の末尾の行（改行で終わらない行）は次回に回す
+    """
+    added_dates, removed_dates = [], []
+    with open(path, "rb") as f, open(path, "rb") as lookup:
+        f.seek(start)
+        offset = start
+        for line in iter(f.readline, b""):
+            if not line.endswith(b"\n"):
+                break
+            line_offset, offset = offset, offset + len(line)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            isbn = record.get("isbn")
+            if not isbn:
+                continue
+            previous = index["offsets"].get(isbn)
+            if previous is not None:
+                # 再取得で更新されたレコードは、以前の行の内容でキーを取り除いてから登録し直す
+                old_record = read_record_at(lookup, previous)
+                remove_record(index, old_record)
+                removed_dates.append(date_entry(old_record))
+            add_record(index, record, line_offset)
+            added_dates.append(date_entry(record))
+    # 出版日のインデックスは1件ずつ挿入せず、最後にまとめて並べ直す
+    merge_dates(index, added_dates, removed_dates)
+    return offset
+
+
+def empty_index() -> Dict:
+    """
+    空のインデックスを作る
+    """
+    index = {name: {} for name in INDEX_PARTS}
+    index["date"] = {"dates": [], "isbns": []}
+    return index
+
+
+def refresh_index(parts: Iterable[str] = INDEX_PARTS, rebuild: bool = False,
+                  data_dir: Optional[str] = None) -> Dict:
+    """
+    ログに追記された行をインデックスに反映し、指定した部分を返す
+    インデックスがない・形式が古い・ログが書き直された場合は作り直す
+    """
+    path = data_paths.resolve(record_store.RECORDS_LOG_FILE, data_dir)
+    stat = os.stat(path) if os.path.exists(path) else None
+    size = stat.st_size if stat else 0
+    inode = stat.st_ino if stat else 0
+    meta = None if rebuild else load_meta(data_dir)
+    if meta and (meta.get("version") != INDEX_VERSION or meta["log_inode"] != inode or meta["log_size"] > size
+                 or (size and tail_digest(path, meta["log_size"]) != meta["tail_sha1"])):
+        meta = None
+    if meta and meta["log_size"] == size:
+        return load_parts(parts, data_dir)
+
+    if meta is None:
+        index, start = empty_index(), 0
+        print(f"レコードストアのインデックスを作成します: {path}")
+    else:
+        index, start = load_parts(INDEX_PARTS, data_dir), meta["log_size"]
+    end = index_log(index, path, start) if size else 0
+    save_index(index, {"version": INDEX_VERSION, "log_inode": inode, "log_size": end,
+                       "tail_sha1": tail_digest(path, end) if size else "", "records": len(index["offsets"])},
+               data_dir)
+    return index
+
+
+def update_if_present(data_dir: Optional[str] = None):
+    """
+    インデックスを作成済みの場合のみ、ログに追記された行を反映する（fetch_shinsho.py の保存後に呼ぶ）
+    """
+    if load_meta(data_dir) is not None:
+        refresh_index(parts=(), data_dir=data_dir)
+
+
+def lookup(index: Dict, name: str, value: str) -> Set[str]:
+    """
+    シリーズ名・出版社・著者名のインデックスから、正規化した値が一致するISBNを返す
+    """
+    return set(index[name].get(normalize_key(value), []))
+
+
+def lookup_dates(index: Dict, since: str = "", until: str = "") -> Set[str]:
+    """
+    出版日がsince以上until以下（いずれも8桁に揃えた値、空なら制限なし）のISBNを返す
+    """
+    dates = index["date"]["dates"]
+    start = bisect_left(dates, since) if since else 0
+    end = bisect_right(dates, until) if until else len(dates)
+    return set(index["date"]["isbns"][start:end])
+
+
+def read_records(index: Dict, isbns: Iterable[str], data_dir: Optional[str] = None) -> List[Dict]:
+    """
+    ISBNに対応するレコードをログから読み出す（該当する行だけを読む）
+    """
+    offsets = sorted(index["offsets"][isbn] for isbn in isbns if isbn in index["offsets"])
+    if not offsets:
+        return []
+    with open(data_paths.resolve(record_store.RECORDS_LOG_FILE, data_dir), "rb") as f:
+        return [read_record_at(f, offset) for offset in offsets]
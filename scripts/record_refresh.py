@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+保存済みの新書レコードを少しずつ再取得して最新の内容に保つためのモジュール
+
+1回の実行で再取得する件数を制限し、出版日が新しい書籍を優先したうえで、
+残りは取得日時の古い順に巡回する。巡回位置はリフレッシュカーソルとして保存する。
+取得に失敗したISBNはカーソルとは別に保存し、次回の実行で最初に再取得する。
+"""
+import hashlib
+import json
+import os
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import data_paths
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+REFRESH_STATE_FILE = os.path.join(DATA_DIR, "refresh_state.json")
+RECENT_DAYS = 90  # この日数以内に出版された（または出版予定の）書籍を優先する
+HASH_EXCLUDED_FIELDS = ("fetched_at",)  # 内容の比較から除外するフィールド
+
+
+def content_hash(record: Dict) -> str:
+    """
+    取得日時などを除いたレコード内容のハッシュを計算
+    """
+    content = {key: value for key, value in record.items() if key not in HASH_EXCLUDED_FIELDS}
+    encoded = json.dumps(content, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def load_refresh_state(data_dir: Optional[str] = None) -> Dict:
+    """
+    リフレッシュカーソルを読み込む
+    """
+    state_file = data_paths.resolve(REFRESH_STATE_FILE, data_dir)
+    if os.path.exists(state_file):
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"cursor": None, "retry": []}
+
+
+def save_refresh_state(state: Dict, data_dir: Optional[str] = None):
+    """
+    リフレッシュカーソルを保存
+    """
+    state_file = data_paths.resolve(REFRESH_STATE_FILE, data_dir)
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    state["updated_at"] = datetime.now().isoformat()
+    with open(state_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def normalize_date(date: str) -> str:
+    """
+    YYYYMMDD / YYYYMM / YYYY 形式の出版日を比較可能な8桁に揃える
+    """
+    digits = "".join(ch for ch in (date or "") if ch.isdigit())[:8]
+    return digits.ljust(8, "0") if digits else ""
+
+
+def select_refresh_targets(records: Dict[str, Dict], budget: int, state: Dict) -> List[str]:
+    """
+    再取得するISBNを最大budget件選び、stateのカーソルを進める
+
+    前回の実行で取得に失敗したISBNを最初に選び、残りの予算の半分までは出版日が新しい書籍に充て、
+    残りは取得日時の古い順に前回の続きから巡回する（末尾に達したら先頭に戻る）
+    """
+    if budget <= 0 or not records:
+        return []
+
+    # 前回失敗したISBN（その後レコードから消えたものは除く）
+    targets = [isbn for isbn in state.get("retry", []) if isbn in records][:budget]
+    selected = set(targets)
+
+    cutoff = (datetime.now() - timedelta(days=RECENT_DAYS)).strftime("%Y%m%d")
+    recent = [isbn for isbn, record in records.items()
+              if isbn not in selected and normalize_date(record.get("publishing_date", "")) >= cutoff]
+    recent.sort(key=lambda isbn: (normalize_date(records[isbn].get("publishing_date", "")), isbn), reverse=True)
+    targets.extend(recent[:(budget - len(targets) + 1) // 2])
+    selected.update(targets)
+
+    # 残りは取得日時の古い順に、前回のカーソルの次から巡回する
+    rotation = sorted((record.get("fetched_at", ""), isbn) for isbn, record in records.items())
+    cursor = tuple(state["cursor"]) if state.get("cursor") else None
+    start = bisect_right(rotation, cursor) if cursor else 0
+    for offset in range(len(rotation)):
+        if len(targets) >= budget:
+            break
+        key = rotation[(start + offset) % len(rotation)]
+        if key[1] in selected:
+            continue
+        targets.append(key[1])
+        selected.add(key[1])
+        state["cursor"] = list(key)
+    return targets
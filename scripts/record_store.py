@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+新書レコードを追記型のJSONLログとして保存するモジュール
+
+1行に1レコードを書き込み、同じISBNが複数回現れた場合は後の行を優先する。
+古い行が増えすぎた場合は最新のレコードのみでログを書き直す（コンパクション）。
+"""
+import json
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+import book_record
+import data_paths
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+RECORDS_LOG_FILE = os.path.join(DATA_DIR, "shinsho_records.jsonl")
+LEGACY_RECORDS_FILE = os.path.join(DATA_DIR, "shinsho_records.json")
+COMPACTION_RATIO = 1.5  # ログ行数がレコード数のこの倍率を超えたらコンパクションする
+COMPACTION_MIN_LINES = 1000  # これより行数が少ない場合はコンパクションしない
+
+
+def records_exist(data_dir: Optional[str] = None) -> bool:
+    """
+    保存済みのレコードストアが存在するかを判定（旧形式のJSONファイルも含む）
+    """
+    if os.path.exists(data_paths.resolve(RECORDS_LOG_FILE, data_dir)):
+        return True
+    legacy_file = data_paths.resolve(LEGACY_RECORDS_FILE, data_dir)
+    return os.path.exists(legacy_file) and os.path.getsize(legacy_file) > 0
+
+
+def read_log(path: str) -> Tuple[Dict[str, Dict], int]:
+    """
+    JSONLログを読み込み、ISBNをキーとするレコード（BookRecord）とログの行数を返す
+    書き込み途中で中断された末尾の行は無視する
+    """
+    records: Dict[str, book_record.Record] = {}
+    line_count = 0
+    if not os.path.exists(path):
+        return records, line_count
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"壊れたレコード行をスキップしました ({path}:{line_num})")
+                continue
+            line_count += 1
+            isbn = record.get("isbn", "")
+            if isbn:
+                records[isbn] = book_record.compact_record(record)
+    return records, line_count
+
+
+def migrate_legacy_records(data_dir: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    旧形式の shinsho_records.json をJSONLログに変換し、旧ファイルを削除する
+    """
+    legacy_file = data_paths.resolve(LEGACY_RECORDS_FILE, data_dir)
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    print(f"旧形式のレコードファイルをJSONLログに移行します ({len(records)}件)")
+    compact(records, data_dir)
+    os.remove(legacy_file)
+    return {isbn: book_record.compact_record(record) for isbn, record in records.items()}
+
+
+def load_records(data_dir: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    レコードストアを読み込む。必要に応じて旧形式からの移行とコンパクションを行う
+    """
+    log_file = data_paths.resolve(RECORDS_LOG_FILE, data_dir)
+    if not os.path.exists(log_file):
+        if records_exist(data_dir):
+            return migrate_legacy_records(data_dir)
+        return {}
+
+    records, line_count = read_log(log_file)
+    if line_count >= COMPACTION_MIN_LINES and line_count > len(records) * COMPACTION_RATIO:
+        print(f"レコードログをコンパクションします ({line_count}行 → {len(records)}件)")
+        compact(records, data_dir)
+    return records
+
+
+def append_records(records: Iterable[Dict], data_dir: Optional[str] = None):
+    """
+    レコードをログの末尾に追記する（書き込みコストは追記件数に比例）
+    追記するレコードがなくてもログファイルは作成し、次回以降の差分更新の目印にする
+    """
+    log_file = data_paths.resolve(RECORDS_LOG_FILE, data_dir)
+    lines = [json.dumps(book_record.to_plain(record), ensure_ascii=False) + "\n" for record in records]
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    with open(log_file, "a", encoding="utf-8") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compact(records: Dict[str, Dict], data_dir: Optional[str] = None):
+    """
+    最新のレコードのみでログを書き直す（ISBN順に並べて差分を安定させる）
+    """
+    log_file = data_paths.resolve(RECORDS_LOG_FILE, data_dir)
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    tmp_path = f"{log_file}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for isbn in sorted(records):
+            f.write(json.dumps(book_record.to_plain(records[isbn]), ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, log_file)
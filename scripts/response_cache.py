@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+openBD APIのレスポンスをディスクにキャッシュするモジュール（開発・デバッグ用）
+
+/get の結果は書籍ごとに圧縮してSQLiteに保存し、保存からの経過時間（TTL）と
+合計サイズの上限（最近使われていないものから削除するLRU）で管理する。
+/coverage は本文を圧縮して保存し、ETag / Last-Modified による条件付きリクエストで
+変更がなければ304の応答だけで保存済みの本文を使う。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, Mapping, Tuple
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+DEFAULT_MAX_MB = 512  # /get キャッシュの合計サイズの上限（MB）
+DEFAULT_TTL_DAYS = 7  # /get キャッシュの有効期間（日）
+EVICTION_TARGET_RATIO = 0.9  # 上限を超えたらこの割合まで削除する
+SQLITE_MAX_VARIABLES = 500  # 1回のクエリで指定するISBNの最大数
+COVERAGE_CHUNK_SIZE = 64 * 1024  # 保存済みカバレッジを読み出すときのチャンクサイズ
+
+
+class ResponseCache:
+    """
+    /get の書籍ごとのレスポンスと /coverage の本文を保存するキャッシュ
+    取得スレッドから同時に使えるよう、データベースへのアクセスはロックで直列化する
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_mb: float = DEFAULT_MAX_MB,
+                 ttl_days: float = DEFAULT_TTL_DAYS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.coverage_file = os.path.join(directory, "coverage.json.zlib")
+        self.coverage_meta_file = os.path.join(directory, "coverage_meta.json")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, "responses.sqlite3"), check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "isbn TEXT PRIMARY KEY, body BLOB NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+
+    def get_many(self, isbns: Iterable[str]) -> Dict[str, bytes]:
+        """
+        有効期間内のキャッシュがあるISBNについて、書籍1件分のJSON（またはnull）を返す
+        """
+        isbns = list(isbns)
+        now = time.time()
+        found: Dict[str, bytes] = {}
+        with self.lock, self.connection:
+            for i in range(0, len(isbns), SQLITE_MAX_VARIABLES):
+                chunk = isbns[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT isbn, body FROM responses WHERE isbn IN ({placeholders}) AND stored_at >= ?",
+                    chunk + [now - self.ttl_seconds]
+                ).fetchall()
+                for isbn, body in rows:
+                    found[isbn] = zlib.decompress(body)
+                hits = [isbn for isbn in chunk if isbn in found]
+                if hits:
+                    self.connection.execute(
+                        f"UPDATE responses SET accessed_at = ? WHERE isbn IN ({','.join('?' * len(hits))})",
+                        [now] + hits
+                    )
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]):
+        """
+        書籍1件分のJSONをISBNごとに圧縮して保存し、上限を超えたら古いものを削除する
+        """
+        now = time.time()
+        rows = [(isbn, zlib.compress(body), now, now) for isbn, body in items]
+        if not rows:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses (isbn, body, stored_at, accessed_at) VALUES (?, ?, ?, ?)", rows)
+            self.total_bytes += sum(len(row[1]) for row in rows)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        期限切れのエントリーを削除し、合計サイズが上限を超えていれば
+        最近使われていないものから上限の9割まで削除する（ロックを保持した状態で呼ぶ）
+        """
+        self.connection.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        # 同じ時刻に保存・参照されたエントリーも多いため、時刻ではなく行単位で削除する
+        target = self.max_bytes * EVICTION_TARGET_RATIO
+        kept = 0
+        evicted = []
+        for isbn, size in self.connection.execute(
+                "SELECT isbn, LENGTH(body) FROM responses ORDER BY accessed_at DESC, rowid DESC"):
+            kept += size
+            if kept > target:
+                evicted.append((isbn,))
+        self.connection.executemany("DELETE FROM responses WHERE isbn = ?", evicted)
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        print(f"レスポンスキャッシュを整理しました（{self.total_bytes / 1024 / 1024:.1f}MB）")
+
+    def coverage_headers(self) -> Dict[str, str]:
+        """
+        保存済みのカバレッジを再検証するための条件付きリクエストのヘッダーを返す
+        """
+        if not (os.path.exists(self.coverage_file) and os.path.exists(self.coverage_meta_file)):
+            return {}
+        with open(self.coverage_meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def iter_coverage(self) -> Iterator[bytes]:
+        """
+        保存済みのカバレッジの本文を伸長しながら返す
+        """
+        decompressor = zlib.decompressobj()
+        with open(self.coverage_file, "rb") as f:
+            while True:
+                chunk = f.read(COVERAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    def store_coverage(self, chunks: Iterable[bytes], headers: Mapping[str, str]) -> Iterator[bytes]:
+        """
+        カバレッジの本文をそのまま返しつつ圧縮して保存する
+        最後まで読み終えた場合のみ、保存した本文とETag / Last-Modifiedを有効にする
+        （ETagもLast-Modifiedもない応答は保存しない）
+        """
+        if not headers.get("ETag") and not headers.get("Last-Modified"):
+            # 再検証できない応答は保存しても使えないため、そのまま返す
+            yield from chunks
+            return
+        tmp_path = f"{self.coverage_file}.tmp"
+        compressor = zlib.compressobj()
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(compressor.compress(chunk))
+                yield chunk
+            f.write(compressor.flush())
+        os.replace(tmp_path, self.coverage_file)
+        with open(self.coverage_meta_file, "w", encoding="utf-8") as f:
+            json.dump({"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+                       "stored_at": time.time()}, f, ensure_ascii=False, indent=2)
+
+    def close(self):
+        """
+        期限切れのエントリーを削除してデータベースを閉じる
+        """
+        with self.lock, self.connection:
+            self.evict()
+        self.connection.close()
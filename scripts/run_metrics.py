@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+実行時の性能指標を集計し、実行レポートとして保存するモジュール
+
+処理段階ごとの所要時間をヒストグラムに記録し、転送量・処理件数・ピークメモリと
+あわせてJSON（最新の1回分）とJSONL（実行ごとの履歴）に書き出す。
+集計はスレッドセーフで、モジュール全体で1つの集計を共有する（loggingと同様の使い方）。
+プロセスプールのワーカーで集計した分は snapshot() で親プロセスに返し、merge() で加える。
+"""
+import cProfile
+import copy
+import io
+import json
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+import data_paths
+
+try:
+    import resource
+except ImportError:  # Windowsでは利用できない
+    resource = None
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+RUN_REPORT_FILE = os.path.join(DATA_DIR, "run_report.json")
+RUN_HISTORY_FILE = os.path.join(DATA_DIR, "run_reports.jsonl")
+RUN_HISTORY_MAX_ENTRIES = 90  # 履歴に残す実行レポートの数（古いものから削除し、gitで管理するファイルの肥大化を防ぐ）
+PROFILE_FILE = os.path.join(DATA_DIR, "profile.prof")
+PROFILE_TOP_N = 30  # プロファイル結果として表示する関数の数
+
+
+class Histogram:
+    """
+    所要時間を2のべき乗のマイクロ秒バケットで数えるヒストグラム
+    サンプルを保持しないため、呼び出し回数が多くてもメモリは一定
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        micros = max(1, int(seconds * 1_000_000))
+        bucket = micros.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.min = min(self.min, seconds) if self.count else seconds
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, ratio: float) -> float:
+        """
+        指定した割合の値（秒）を推定する
+        該当するバケットの範囲（観測した最小値・最大値で狭めたもの）の中で、順位に応じて線形補間する
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * ratio))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            in_bucket = self.buckets[bucket]
+            if seen + in_bucket >= rank:
+                # バケットbucketは 2 ** (bucket - 1) 以上 2 ** bucket 未満のマイクロ秒
+                lower = max(self.min, (2 ** (bucket - 1)) / 1_000_000)
+                upper = min(self.max, (2 ** bucket) / 1_000_000)
+                if upper <= lower:
+                    return upper
+                return lower + (upper - lower) * (rank - seen) / in_bucket
+            seen += in_bucket
+        return self.max
+
+    def merge(self, other: "Histogram"):
+        """
+        別のヒストグラム（ワーカープロセスの集計など）の観測値を加える
+        """
+        if not other.count:
+            return
+        for bucket, n in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+        self.min = min(self.min, other.min) if self.count else other.min
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "min_ms": round(self.min * 1000, 3),
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p90_ms": round(self.percentile(0.90) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets_us": {str(2 ** bucket): n for bucket, n in sorted(self.buckets.items())}
+        }
+
+
+class RunMetrics:
+    """
+    1回の実行の性能指標（段階別ヒストグラム、カウンター、経過時間）
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.started_at = datetime.now()
+        self.start_clock = time.perf_counter()
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def add(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_clock
+
+    def snapshot(self) -> Dict:
+        """
+        段階別ヒストグラムとカウンターの複製を返す（pickle可能で、プロセス間で受け渡せる）
+        """
+        with self.lock:
+            return {"histograms": copy.deepcopy(self.histograms), "counters": dict(self.counters)}
+
+    def merge(self, snapshot: Dict):
+        """
+        snapshot() で得た集計を加える
+        """
+        with self.lock:
+            for name, histogram in snapshot["histograms"].items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram()
+                self.histograms[name].merge(histogram)
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+
+_metrics = RunMetrics()
+
+
+def reset():
+    """
+    集計を初期化する（実行の開始時に呼ぶ）
+    """
+    global _metrics
+    _metrics = RunMetrics()
+
+
+def observe(name: str, seconds: float):
+    """
+    処理段階の所要時間を記録
+    """
+    _metrics.observe(name, seconds)
+
+
+def add(name: str, value: int = 1):
+    """
+    カウンターを加算（転送バイト数やリクエスト数など）
+    """
+    _metrics.add(name, value)
+
+
+def snapshot() -> Dict:
+    """
+    現在の集計の複製を返す（プロセスプールのワーカーから親プロセスへ集計を返すのに使う）
+    """
+    return _metrics.snapshot()
+
+
+def merge(snapshot: Dict):
+    """
+    ワーカープロセスなどで集計した snapshot() の結果を現在の集計に加える
+    """
+    _metrics.merge(snapshot)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    with文で囲んだ処理の所要時間を記録
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name: str, func: Callable, *args, **kwargs):
+    """
+    関数呼び出しの所要時間を記録して結果を返す
+    """
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterator:
+    """
+    イテレーターから要素を取り出すのにかかった時間の合計を1回分として記録
+    （遅延デコードのように、処理が消費側と交互に進む場合に使う）
+    """
+    iterator = iter(iterable)
+    spent = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                spent += time.perf_counter() - start
+                return
+            spent += time.perf_counter() - start
+            yield item
+    finally:
+        observe(name, spent)
+
+
+def peak_memory_mb() -> Optional[float]:
+    """
+    プロセスのピークメモリ使用量（MB）を返す
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト単位、Linuxはキロバイト単位
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def build_report(extra: Optional[Dict] = None) -> Dict:
+    """
+    集計した指標から実行レポートを作成
+    """
+    with _metrics.lock:
+        elapsed = _metrics.elapsed()
+        counters = dict(_metrics.counters)
+        stages = {name: histogram.summary() for name, histogram in sorted(_metrics.histograms.items())}
+
+    per_second = lambda value: round(value / elapsed, 2) if elapsed > 0 else 0.0
+    report = {
+        "started_at": _metrics.started_at.isoformat(),
+        "finished_at": datetime.now().isoformat(),
+        "elapsed_seconds": round(elapsed, 3),
+        "peak_memory_mb": peak_memory_mb(),
+        "counters": counters,
+        "throughput": {
+            "isbns_per_second": per_second(counters.get("isbns_processed", 0)),
+            "records_per_second": per_second(counters.get("records_extracted", 0)),
+            "bytes_per_second": per_second(counters.get("bytes_received", 0))
+        },
+        "stages": stages
+    }
+    if extra:
+        report.update(extra)
+    return report
+
+
+def save_report(report: Dict, data_dir: Optional[str] = None):
+    """
+    最新の実行レポートを保存し、履歴に1行追記する
+    """
+    report_file = data_paths.resolve(RUN_REPORT_FILE, data_dir)
+    os.makedirs(os.path.dirname(report_file), exist_ok=True)
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    append_history([report], data_dir)
+
+
+def append_history(reports: Iterable[Dict], data_dir: Optional[str] = None):
+    """
+    実行レポートを履歴に追記し、RUN_HISTORY_MAX_ENTRIES件を超えた古いレポートを削除する
+    """
+    history_file = data_paths.resolve(RUN_HISTORY_FILE, data_dir)
+    os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    with open(history_file, "a", encoding="utf-8") as f:
+        for report in reports:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    with open(history_file, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    if len(lines) <= RUN_HISTORY_MAX_ENTRIES:
+        return
+    temp_file = history_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        f.writelines(lines[-RUN_HISTORY_MAX_ENTRIES:])
+    os.replace(temp_file, history_file)
+
+
+def run_profiled(func: Callable, *args, **kwargs):
+    """
+    cProfileで関数を実行し、結果をファイルに保存して上位の関数を表示する
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        profiler.dump_stats(PROFILE_FILE)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        print(output.getvalue())
+        print(f"プロファイル結果を保存しました: {PROFILE_FILE}")
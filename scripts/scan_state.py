@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+全件スキャンの進捗（スキャンカーソル）を保存・復元するモジュール
+
+カーソルにはカバレッジのスナップショットID、完了したバッチ番号の範囲、
+失敗したバッチ番号を記録し、複数回のジョブにまたがるスキャンを再開できるようにする。
+"""
+import hashlib
+import json
+import os
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import data_paths
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+SCAN_STATE_FILE = os.path.join(DATA_DIR, "scan_state.json")
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+
+
+def compute_snapshot_id(isbns: array) -> str:
+    """
+    数値化したISBNリストの内容と順序から決まるスナップショットIDを計算
+    """
+    return hashlib.sha1(isbns.tobytes()).hexdigest()
+
+
+def new_scan_state(snapshot_id: str, total_batches: int, batch_size: int, options: Dict) -> Dict:
+    """
+    新しいスキャンカーソルを作成
+    """
+    now = datetime.now().isoformat()
+    return {
+        "snapshot_id": snapshot_id,
+        "status": STATUS_RUNNING,
+        "batch_size": batch_size,
+        "total_batches": total_batches,
+        "options": options,
+        "completed": [],
+        "failed": [],
+        "started_at": now,
+        "updated_at": now
+    }
+
+
+def load_scan_state(data_dir: Optional[str] = None) -> Optional[Dict]:
+    """
+    保存されたスキャンカーソルを読み込む
+    """
+    state_file = data_paths.resolve(SCAN_STATE_FILE, data_dir)
+    if os.path.exists(state_file) and os.path.getsize(state_file) > 0:
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+def save_scan_state(state: Dict, data_dir: Optional[str] = None):
+    """
+    スキャンカーソルを保存（書き込み途中で中断されても壊れないよう置き換えで保存）
+    """
+    state_file = data_paths.resolve(SCAN_STATE_FILE, data_dir)
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    state["updated_at"] = datetime.now().isoformat()
+    tmp_path = f"{state_file}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_file)
+
+
+def is_completed(state: Dict, batch_index: int) -> bool:
+    """
+    バッチが完了済みかどうかを判定
+    """
+    return any(start <= batch_index <= end for start, end in state["completed"])
+
+
+def mark_completed(state: Dict, batch_index: int):
+    """
+    バッチを完了済みにし、隣接する範囲を結合する
+    """
+    ranges = state["completed"] + [[batch_index, batch_index]]
+    ranges.sort()
+    merged: List[List[int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    state["completed"] = merged
+    if batch_index in state["failed"]:
+        state["failed"].remove(batch_index)
+
+
+def mark_failed(state: Dict, batch_index: int):
+    """
+    バッチを失敗として記録し、次回の再開時に再試行させる
+    """
+    if batch_index not in state["failed"]:
+        state["failed"].append(batch_index)
+        state["failed"].sort()
+
+
+def pending_batches(state: Dict) -> List[int]:
+    """
+    未完了のバッチ番号を、失敗したバッチを先頭にして返す
+    """
+    failed = [i for i in state["failed"] if not is_completed(state, i)]
+    failed_set = set(failed)
+    rest = [i for i in range(state["total_batches"])
+            if i not in failed_set and not is_completed(state, i)]
+    return failed + rest
+
+
+def completed_count(state: Dict) -> int:
+    """
+    完了済みのバッチ数を返す
+    """
+    return sum(end - start + 1 for start, end in state["completed"])
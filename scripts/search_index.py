@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+ランディングページから検索できる静的な検索インデックスを管理するモジュール
+
+書名・サブタイトル・著者名・シリーズ名の文字bigram（隣り合う2文字）の転置インデックスを、
+bigramのハッシュで TERM_SHARD_COUNT 個のシャード（docs/search/terms/<番号>.json）に分けて出力する。
+各書籍には追加順の連番（文書番号）を振り、表示と差分更新に使う内容を DOC_SHARD_SIZE 件ずつ
+docs/search/docs/<番号>.json にまとめる。ブラウザは検索語のbigramを含むシャードと、
+結果の表示に必要な文書のシャードだけを取得すればよい。
+差分更新では新規・削除・更新された書籍のbigramが属するシャードだけを読み書きする。
+ISBNと文書番号の対応は data/search_index.json に保存する。
+"""
+import json
+import os
+import shutil
+import unicodedata
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Set
+
+import book_record
+import feed_groups
+import record_store
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs")
+SEARCH_DIR = os.path.join(DOCS_DIR, "search")
+SEARCH_STATE_FILE = os.path.join(DATA_DIR, "search_index.json")
+INDEX_VERSION = 1
+TERM_SHARD_BITS = 12  # bigramのシャード数は 2 ** TERM_SHARD_BITS
+TERM_SHARD_COUNT = 1 << TERM_SHARD_BITS
+DOC_SHARD_SIZE = 64  # 文書のシャード1件あたりの書籍数
+DOC_FIELDS = ("isbn", "title", "subtitle", "author", "collection", "publisher", "publishing_date")  # 文書のシャードの項目
+INDEXED_FIELDS = (1, 2, 3, 4)  # 索引する項目の位置（書名・サブタイトル・著者名・シリーズ名）
+
+Entry = List[str]  # DOC_FIELDSの順の値
+Postings = Dict[str, array]  # bigram -> 昇順の文書番号
+
+
+def normalize(text: str) -> str:
+    """
+    検索用に文字列を正規化する（NFKC、小文字化、文字と数字以外の除去）
+    ブラウザ側の検索（docs/index.html）と同じ規則にそろえる
+    """
+    return "".join(ch for ch in unicodedata.normalize("NFKC", text).lower() if ch.isalnum())
+
+
+def bigrams(text: str) -> Set[str]:
+    """
+    正規化した文字列の文字bigramの集合を返す
+    """
+    text = normalize(text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def entry_bigrams(entry: Optional[Entry]) -> Set[str]:
+    """
+    文書の索引対象の項目に含まれるbigramの集合を返す（項目をまたぐbigramは作らない）
+    """
+    terms: Set[str] = set()
+    if entry:
+        for index in INDEXED_FIELDS:
+            terms |= bigrams(entry[index])
+    return terms
+
+
+def term_shard(term: str) -> int:
+    """
+    bigramが属するシャードの番号を返す（ブラウザ側と同じ32ビットの乗算ハッシュ）
+    """
+    first = ord(term[0])
+    second = ord(term[1]) if len(term) > 1 else 0
+    mixed = (first * 0x9E3779B1 + second) & 0xFFFFFFFF
+    return ((mixed * 0x85EBCA6B) & 0xFFFFFFFF) >> (32 - TERM_SHARD_BITS)
+
+
+def term_shard_path(shard: int) -> str:
+    """
+    bigramのシャードの保存先を返す
+    """
+    return os.path.join(SEARCH_DIR, "terms", f"{shard:03x}.json")
+
+
+def doc_shard_path(shard: int) -> str:
+    """
+    文書のシャードの保存先を返す
+    """
+    return os.path.join(SEARCH_DIR, "docs", f"{shard}.json")
+
+
+def doc_entry(book: book_record.Record) -> Entry:
+    """
+    レコードから文書のシャードに保存する内容を作る
+    """
+    authors = " ".join(author.get("name", "") for author in book.get("authors") or [] if author.get("name"))
+    return [book.get("isbn") or "", book.get("title") or "", book.get("subtitle") or "", authors,
+            book.get("collection") or "", book.get("imprint") or book.get("publisher") or "",
+            book.get("publishing_date") or ""]
+
+
+def load_search_state() -> Optional[Dict]:
+    """
+    ISBNと文書番号の対応を読み込む（まだ索引を作っていなければNone）
+    """
+    if not os.path.exists(SEARCH_STATE_FILE):
+        return None
+    with open(SEARCH_STATE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_search_state(state: Dict):
+    """
+    ISBNと文書番号の対応を保存
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(SEARCH_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def reset_search_index():
+    """
+    検索インデックスを削除し、次回の update_search_index でレコードストアの全レコードから作り直されるようにする
+    （レコードストアを書き直した後に、以前の索引の文書やbigramが残らないようにする）
+    """
+    if os.path.exists(SEARCH_STATE_FILE):
+        os.remove(SEARCH_STATE_FILE)
+    for name in ("terms", "docs"):
+        shutil.rmtree(os.path.join(SEARCH_DIR, name), ignore_errors=True)
+
+
+def dump_json(value) -> bytes:
+    """
+    シャードの内容を空白なしのJSONにする（同じ内容なら同じバイト列になる）
+    """
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_ids(ids: Iterable[int]) -> List[int]:
+    """
+    昇順の文書番号を先頭の値と差分の列に変換する
+    """
+    deltas = []
+    previous = 0
+    for doc_id in ids:
+        deltas.append(doc_id - previous)
+        previous = doc_id
+    return deltas
+
+
+def decode_ids(deltas: List[int]) -> List[int]:
+    """
+    差分の列から昇順の文書番号を復元する
+    """
+    return list(accumulate(deltas))
+
+
+def load_term_shard(shard: int) -> Dict[str, List[int]]:
+    """
+    bigramのシャードを差分の列のまま読み込む
+    """
+    path = term_shard_path(shard)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_term_shard(shard: int, encoded: Dict[str, List[int]]) -> bool:
+    """
+    bigramのシャードを保存し（空になったら削除）、書き換えたかを返す
+    """
+    path = term_shard_path(shard)
+    if not encoded:
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+    return feed_groups.write_if_changed(path, dump_json(dict(sorted(encoded.items()))))
+
+
+def apply_postings(encoded: Dict[str, List[int]], added: Postings, dropped: Postings):
+    """
+    差分の列のままのシャードに文書番号の追加・削除を反映する
+    変更のないbigramは復元せず、末尾への追加だけのbigramは差分を書き足す
+    """
+    for term in set(added) | set(dropped):
+        deltas = encoded.get(term)
+        new_ids = added.get(term)
+        if term not in dropped and new_ids:
+            if deltas is None:
+                encoded[term] = encode_ids(new_ids)
+                continue
+            last = sum(deltas)
+            if last < new_ids[0]:
+                # 新しい書籍は最大の番号なので末尾に書き足すだけでよい
+                deltas.append(new_ids[0] - last)
+                deltas.extend(encode_ids(new_ids)[1:])
+                continue
+        ids = set(decode_ids(deltas or []))
+        ids.difference_update(dropped.get(term, ()))
+        ids.update(new_ids or ())
+        if ids:
+            encoded[term] = encode_ids(sorted(ids))
+        else:
+            encoded.pop(term, None)
+
+
+def load_doc_shard(shard: int) -> List[Optional[Entry]]:
+    """
+    文書のシャードを読み込む（削除された書籍と未使用の番号はNone）
+    """
+    path = doc_shard_path(shard)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(state: Dict) -> bool:
+    """
+    ブラウザ側が最初に読む索引の設定（docs/search/meta.json）を保存
+    """
+    meta = {
+        "version": INDEX_VERSION,
+        "term_shard_bits": TERM_SHARD_BITS,
+        "doc_shard_size": DOC_SHARD_SIZE,
+        "docs": len(state["isbns"])
+    }
+    return feed_groups.write_if_changed(os.path.join(SEARCH_DIR, "meta.json"), dump_json(meta))
+
+
+def update_search_index(new_records: Iterable[book_record.Record], removed_isbns: Iterable[str],
+                        updated_records: Iterable[book_record.Record]) -> Dict[str, int]:
+    """
+    新規・削除・更新された書籍を検索インデックスに反映し、書き換えたシャード数などを返す
+    索引がまだなければレコードストアの全レコードから作る
+    """
+    state = load_search_state()
+    if state is None:
+        # 取得日時の古い順に文書番号を振り、新しい書籍ほど大きい番号になるようにする
+        state = {"next_id": 0, "isbns": {}}
+        new_records = sorted(record_store.load_records(DATA_DIR).values(),
+                             key=lambda book: (book.get("fetched_at") or "", book.get("isbn") or ""))
+        updated_records = []
+        print(f"検索インデックスを作成します: {len(new_records)}件")
+    ids: Dict[str, int] = state["isbns"]
+
+    # 文書番号ごとの新しい内容（Noneは削除）
+    changes: Dict[int, Optional[Entry]] = {}
+    for isbn in removed_isbns:
+        doc_id = ids.pop(isbn, None)
+        if doc_id is not None:
+            changes[doc_id] = None
+    for book in list(updated_records) + list(new_records):
+        isbn = book.get("isbn")
+        if not isbn:
+            continue
+        doc_id = ids.get(isbn)
+        if doc_id is None:
+            doc_id = ids[isbn] = state["next_id"]
+            state["next_id"] += 1
+        changes[doc_id] = doc_entry(book)
+
+    # 変更のある文書のシャードを読み込み、追加・削除するbigramをシャードごとにまとめる
+    doc_shards: Dict[int, List[Optional[Entry]]] = {}
+    added: Dict[int, Postings] = {}
+    dropped: Dict[int, Postings] = {}
+    for doc_id in sorted(changes):
+        shard, offset = divmod(doc_id, DOC_SHARD_SIZE)
+        entries = doc_shards.get(shard)
+        if entries is None:
+            entries = doc_shards[shard] = load_doc_shard(shard)
+        old = entries[offset] if offset < len(entries) else None
+        new = changes[doc_id]
+        if old == new:
+            continue
+        entries.extend([None] * (offset + 1 - len(entries)))
+        entries[offset] = new
+        old_terms, new_terms = entry_bigrams(old), entry_bigrams(new)
+        for target, terms in ((added, new_terms - old_terms), (dropped, old_terms - new_terms)):
+            for term in terms:
+                shard_terms = target.setdefault(term_shard(term), {})
+                ids_array = shard_terms.get(term)
+                if ids_array is None:
+                    ids_array = shard_terms[term] = array("I")
+                ids_array.append(doc_id)
+
+    # 影響のあるbigramのシャードだけを読み書きする（文書番号は昇順に処理したため、各リストも昇順）
+    written_terms = 0
+    for shard in sorted(set(added) | set(dropped)):
+        encoded = load_term_shard(shard)
+        apply_postings(encoded, added.get(shard, {}), dropped.get(shard, {}))
+        if write_term_shard(shard, encoded):
+            written_terms += 1
+
+    written_docs = 0
+    for shard in sorted(doc_shards):
+        entries = doc_shards[shard]
+        while entries and entries[-1] is None:
+            entries.pop()
+        path = doc_shard_path(shard)
+        if entries:
+            written_docs += feed_groups.write_if_changed(path, dump_json(entries))
+        elif os.path.exists(path):
+            os.remove(path)
+            written_docs += 1
+
+    if changes or not os.path.exists(SEARCH_STATE_FILE):
+        save_search_state(state)
+    write_meta(state)
+    return {"docs": len(ids), "term_shards": written_terms, "doc_shards": written_docs}
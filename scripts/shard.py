@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+全件スキャンを複数のジョブに分割（シャーディング）するためのモジュール
+
+ISBNの値（チェックディジットを除いた12桁）の剰余でシャードを決めるため、
+各ジョブが取得したカバレッジの並び順や取得時刻によらず同じ分割になる。
+各シャードの出力は data/shards/<i>-of-<N>/ に保存し、merge_shards.py で統合する。
+"""
+import argparse
+import os
+import shutil
+from array import array
+from typing import Tuple
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+SHARDS_DIR = os.path.join(DATA_DIR, "shards")
+
+
+def parse_shard_spec(spec: str) -> Tuple[int, int]:
+    """
+    "i/N" 形式のシャード指定を (i, N) に変換（argparseのtypeとして使う）
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"シャードは i/N の形式で指定してください: {spec}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"シャード番号は 0 以上 N 未満で指定してください: {spec}")
+    return index, count
+
+
+def shard_dir(index: int, count: int) -> str:
+    """
+    シャードの出力ディレクトリのパスを返す
+    """
+    return os.path.join(SHARDS_DIR, f"{index}-of-{count}")
+
+
+def in_shard(value: int, index: int, count: int) -> bool:
+    """
+    数値化したISBNが指定したシャードに属するかを判定
+    """
+    return (value // 10) % count == index
+
+
+def filter_shard(values: array, index: int, count: int) -> array:
+    """
+    指定したシャードに属するISBNのみを元の順序のまま返す
+    """
+    return array("Q", (value for value in values if in_shard(value, index, count)))
+
+
+def clear_shard_dir(directory: str):
+    """
+    シャードの出力を削除して空のディレクトリに戻す
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+新書判定の高速パス（iter_candidate_books）が従来の全件デコード + is_shinsho と
+同じ結果になることを、記録したopenBDレスポンスのサンプルで検証するスクリプト
+
+リポジトリには openbd_stub.py の合成データから作った小さなサンプル（--synthetic で再作成）を含める。
+「新書」のエスケープ表記（\\u65b0\\u66f8 とその大文字表記）、null要素、説明文や書名にだけ
+「新書」を含む書籍、キーの順序や空白の異なる本文など、高速パスが誤りやすい書籍を含む。
+このサンプルは実際のopenBDのレスポンスではないため、検証できるのは高速パスと従来の判定が
+合成データ上で一致すること（自己整合性）だけで、実際のレスポンスの形式の変化は検出できない。
+実際のレスポンスで検証するには --record で記録したサンプルを使う。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Optional
+
+import fetch_shinsho
+import isbn_index
+import openbd_stub
+
+# 定数
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+SAMPLE_FILE = os.path.join(DATA_DIR, "classifier_sample.jsonl")
+SYNTHETIC_BATCH_SIZE = 8  # 合成サンプルの1バッチあたりのISBN数
+# 合成サンプルのバッチごとの本文の表記（UTF-8のまま / \uXXXX / \uXXXX（16進が大文字））
+SYNTHETIC_ENCODINGS = ("utf-8", "ascii", "ascii-upper", "utf-8", "ascii", "utf-8")
+# 合成サンプルのバッチごとの本文の形式（json.dumpsの既定 / 区切りの空白なし / summaryが先頭 / 改行とインデントあり）
+SYNTHETIC_LAYOUTS = ("default", "compact", "summary-first", "indent", "compact", "default")
+# 合成サンプルの書籍の種類（ISBNの順に繰り返す）
+SYNTHETIC_KINDS = ("collection", "null", "plain", "description", "series", "element_list", "plain", "title")
+NO_SHINSHO_KINDS = ("plain", "null")  # 「新書」を含まないバッチの書籍の種類
+
+
+def record_sample(path: str, count: int, offset: int):
+    """
+    openBDから日本の書籍のレスポンス本文を取得し、バッチごとに1行のJSONLとして保存
+    """
+    all_isbns = fetch_shinsho.get_japanese_isbns(fetch_shinsho.get_all_isbns())
+    targets = [isbn_index.int_to_isbn(value) for value in all_isbns[offset:offset + count]]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(0, len(targets), fetch_shinsho.BATCH_SIZE):
+            batch = targets[i:i + fetch_shinsho.BATCH_SIZE]
+            raw = fetch_shinsho.fetch_books_raw(batch)
+            f.write(json.dumps({"isbns": batch, "body": raw.decode("utf-8")}, ensure_ascii=False) + "\n")
+            print(f"記録しました: {i + len(batch)}/{len(targets)}件")
+
+
+def synthetic_book(isbn: str, index: int, kind: str) -> Optional[Dict]:
+    """
+    合成サンプルの書籍を作る（kindがnullならopenBDに収録されていないISBNとしてNone）
+    """
+    if kind == "null":
+        return None
+    book = openbd_stub.synthetic_book(isbn, index, kind in ("collection", "series", "element_list"))
+    onix = book["onix"]
+    # サンプルを小さく保つため説明文は短くする
+    onix["CollateralDetail"]["TextContent"] = [{"TextType": "03", "ContentAudience": "00", "Text": "内容紹介の文章です。"}]
+    for contributor in onix["DescriptiveDetail"]["Contributor"]:
+        contributor["BiographicalNote"] = "1970年生まれ。"
+
+    collection = onix["DescriptiveDetail"].get("Collection")
+    if kind == "description":
+        # 説明文と著者紹介にだけ「新書」を含む書籍（新書ではない）
+        onix["CollateralDetail"]["TextContent"][0]["Text"] = "新書判の体裁で刊行された評論集。"
+        onix["DescriptiveDetail"]["Contributor"][0]["BiographicalNote"] = "著書に『日本の近代』（岩波新書）など。"
+    elif kind == "title":
+        # 書名にだけ「新書」を含む書籍（新書ではない）
+        onix["DescriptiveDetail"]["TitleDetail"]["TitleElement"]["TitleText"]["content"] = f"新書の読み方{index}"
+        book["summary"]["title"] = f"新書の読み方{index}"
+    elif kind == "series":
+        # Collectionがなく、summaryのseriesだけで判定される新書
+        onix["DescriptiveDetail"].pop("Collection", None)
+    elif kind == "element_list" and collection:
+        # TitleElementが配列の新書
+        element = collection["TitleDetail"]["TitleElement"]
+        collection["TitleDetail"]["TitleElement"] = [{"TitleElementLevel": "01", "TitleText": {"content": "叢書"}}, element]
+    return book
+
+
+def encode_body(books: List[Optional[Dict]], encoding: str, layout: str = "default") -> str:
+    """
+    書籍のリストを /get のレスポンス本文と同じ形式の文字列にする
+    """
+    if layout == "summary-first":
+        books = [{"summary": book["summary"], **book} if book is not None else None for book in books]
+    options = {"separators": (",", ":")} if layout == "compact" else {"indent": 1} if layout == "indent" else {}
+    body = json.dumps(books, ensure_ascii=(encoding != "utf-8"), **options)
+    if encoding == "ascii-upper":
+        body = re.sub(r"\\u([0-9a-f]{4})", lambda match: "\\u" + match.group(1).upper(), body)
+    return body
+
+
+def write_synthetic_sample(path: str):
+    """
+    openbd_stub.py の合成データから、高速パスが誤りやすい書籍を含むサンプルを作成する
+    最後のバッチは「新書」を含まない書籍のみとする
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    index = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for batch_num, (encoding, layout) in enumerate(zip(SYNTHETIC_ENCODINGS, SYNTHETIC_LAYOUTS)):
+            kinds = NO_SHINSHO_KINDS if batch_num == len(SYNTHETIC_ENCODINGS) - 1 else SYNTHETIC_KINDS
+            isbns, books = [], []
+            for offset in range(SYNTHETIC_BATCH_SIZE):
+                # バッチごとに種類の順序をずらし、先頭と末尾の書籍の種類を変える
+                kind = kinds[(offset + batch_num) % len(kinds)]
+                isbn = openbd_stub.isbn13(f"9784{index:08d}")
+                isbns.append(isbn)
+                books.append(synthetic_book(isbn, index, kind))
+                index += 1
+            f.write(json.dumps({"isbns": isbns, "body": encode_body(books, encoding, layout)}, ensure_ascii=False) + "\n")
+    print(f"合成サンプルを作成しました: {path} ({index}件)")
+
+
+def load_sample(path: str) -> List[Dict]:
+    """
+    記録したサンプルを読み込む
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def shinsho_isbns(books) -> List[str]:
+    """
+    新書と判定された書籍のISBNを順に返す
+    """
+    return [book.get("onix", {}).get("RecordReference", "")
+            for book in books if fetch_shinsho.is_shinsho(book)]
+
+
+def verify_sample(batches: List[Dict]) -> bool:
+    """
+    バッチごとに従来の判定と高速パスの判定結果を比較する
+    """
+    ok = True
+    reference_seconds = fast_seconds = 0.0
+    total_books = total_shinsho = 0
+
+    for batch_num, batch in enumerate(batches, 1):
+        raw = batch["body"].encode("utf-8")
+
+        start = time.perf_counter()
+        expected = shinsho_isbns(fetch_shinsho.iter_books(raw))
+        reference_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = shinsho_isbns(fetch_shinsho.iter_candidate_books(raw))
+        fast_seconds += time.perf_counter() - start
+
+        total_books += len(batch["isbns"])
+        total_shinsho += len(expected)
+        if expected != actual:
+            ok = False
+            missing = sorted(set(expected) - set(actual))
+            extra = sorted(set(actual) - set(expected))
+            print(f"不一致 (バッチ {batch_num}): 見逃し={missing}, 誤検出={extra}")
+
+    print(f"検証した書籍数: {total_books} (新書: {total_shinsho}件)")
+    print(f"- 従来の判定: {reference_seconds:.3f}秒")
+    print(f"- 高速パス: {fast_seconds:.3f}秒")
+    print("結果: 一致" if ok else "結果: 不一致あり")
+    return ok
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = argparse.ArgumentParser(description='新書判定の高速パスを記録済みサンプルで検証するスクリプト')
+    parser.add_argument('--sample', default=SAMPLE_FILE, help='サンプルファイルのパス')
+    parser.add_argument('--record', type=int, default=None, help='指定した件数のレスポンスをopenBDから記録してから検証する')
+    parser.add_argument('--offset', type=int, default=0, help='記録を開始する日本の書籍ISBNの位置')
+    parser.add_argument('--synthetic', action='store_true', help='openBDの代わりに合成データからサンプルを作成してから検証する')
+    args = parser.parse_args()
+
+    if args.record:
+        record_sample(args.sample, args.record, args.offset)
+    elif args.synthetic:
+        write_synthetic_sample(args.sample)
+
+    if not os.path.exists(args.sample):
+        print(f"サンプルファイルが見つかりません: {args.sample}（--record で作成してください）")
+        sys.exit(1)
+
+    if not verify_sample(load_sample(args.sample)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+openBDのカバレッジを一定間隔で確認し、新しい新書を見つけたらフィードを更新し続けるスクリプト（watchモード）
+
+1日1回の定期実行と異なり、プロセスを起動したままHTTP接続・既存レコード・分類済みインデックス・
+前回のカバレッジを保持し、周回ごとに追加されたISBNだけを処理する。/coverage は条件付きリクエストで
+確認するため、変化がなければ本文をダウンロードしない。フィードは docs/ にその場で生成し直し、
+--serve を指定すると feed_server.py のサーバーで配信する。
+"""
+import argparse
+import time
+from datetime import datetime
+
+import feed_order
+import feed_server
+import fetch_shinsho
+import generate_rss
+import http_client
+
+# 定数
+DEFAULT_INTERVAL = 300  # 周回の間隔（秒）
+
+
+def watch(args: argparse.Namespace):
+    """
+    取得処理とフィードの生成を一定間隔で繰り返す
+    """
+    warm = fetch_shinsho.WarmState()
+    server = None
+    if args.serve:
+        server = feed_server.create_server(generate_rss.DOCS_DIR, args.host, args.port)
+        url, _ = feed_server.start_in_thread(server)
+        print(f"フィードを配信しています: {url}")
+
+    cycle = 0
+    try:
+        while True:
+            cycle += 1
+            started = time.monotonic()
+            print(f"\n=== 周回 {cycle} を開始します（{datetime.now().isoformat(timespec='seconds')}） ===")
+            try:
+                new_records_data = fetch_shinsho.run(args, warm)
+                if new_records_data is not None:
+                    generate_rss.generate_feed(args.order, new_records_data)
+            except Exception as e:
+                # 一時的な障害で常駐プロセスを止めないよう、次の周回で再試行する
+                print(f"周回 {cycle} でエラーが発生しました: {http_client.describe_error(e)}")
+            elapsed = time.monotonic() - started
+            print(f"周回 {cycle} が完了しました（{elapsed:.1f}秒）")
+            if args.cycles and cycle >= args.cycles:
+                break
+            wait = max(0.0, args.interval - elapsed)
+            print(f"次の周回まで{wait:.0f}秒待機します")
+            time.sleep(wait)
+    except KeyboardInterrupt:
+        print("\nwatchモードを終了します")
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        if warm.session:
+            warm.session.close()
+
+
+def main():
+    """
+    メイン処理
+    """
+    parser = fetch_shinsho.build_arg_parser('openBDのカバレッジを一定間隔で確認し、フィードを更新し続けるスクリプト')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='周回の間隔（秒）')
+    parser.add_argument('--cycles', type=int, default=0, help='指定した回数だけ周回して終了する（0で無制限）')
+    parser.add_argument('--order', choices=feed_order.ORDER_POLICIES, default=feed_order.DEFAULT_ORDER_POLICY,
+                        help='フィードの並び順（fetched: 取得した順、published: 出版日の新しい順）')
+    parser.add_argument('--serve', action='store_true', help='生成したフィードをローカルのHTTPサーバーで配信する')
+    parser.add_argument('--host', default=feed_server.DEFAULT_HOST, help='フィードを配信するアドレス')
+    parser.add_argument('--port', type=int, default=feed_server.DEFAULT_PORT, help='フィードを配信するポート番号')
+    args = parser.parse_args()
+    if args.shard:
+        parser.error("--shard は分割実行用のため watch.py では使えません")
+    if args.profile:
+        parser.error("--profile は watch.py では使えません（fetch_shinsho.py または pipeline.py で計測してください）")
+
+    watch(args)
+
+
+if __name__ == "__main__":
+    main()